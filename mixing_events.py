@@ -0,0 +1,175 @@
+''' detection of mixing or near-mixing events on the rbr temperature chain
+vertical temperature gradients dT/dz (z upward, so > 0 for a stable temperature stratification) are
+computed between neighbouring depth-sorted levels; an event is a contiguous run of time steps where the
+gradient of a layer is below a threshold. The (time x depth) record is streamed chunk by chunk, runs
+crossing chunk boundaries are carried over, so memory is bounded by the chunk size. Events go to a
+compact EventIndex (start, end, top, bottom, min gradient) queried without rescanning the data
+
+E.g.
+    with MooringData('../netcdf') as md:
+        events = detect(md, 'rbr', range(2011, 2020), threshold=0.)
+    events.save('../support_data/mixing_events.npy')
+    events.query(dmin=900, dmax=1100, min_duration=1/24.)
+'''
+import numpy as np
+
+EVENT_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('top', 'f4'), ('bottom', 'f4'),
+                        ('min_gradient', 'f4'), ('samples', 'i8')])
+
+
+def vertical_gradient(temp, depths):
+    ''' dT/dz (degC/m, z upward) between neighbouring levels of a (time x depth) block, levels sorted by depth
+    returns the (top, bottom) depths of the layers and the (time x layer) gradients
+    '''
+    order = np.argsort(depths)
+    depths = np.asarray(depths, dtype=float)[order]
+    temp = np.asarray(temp, dtype=float)[:, order]
+    return depths[:-1], depths[1:], (temp[:, :-1] - temp[:, 1:])/(depths[1:] - depths[:-1])
+
+
+class EventIndex:
+    ''' structured array of events (EVENT_DTYPE) sorted by start time, with vectorized queries '''
+    def __init__(self, events=None):
+        events = np.zeros(0, EVENT_DTYPE) if events is None else np.asarray(events, EVENT_DTYPE)
+        self.events = np.sort(events, order='start')
+
+    def __len__(self):
+        return len(self.events)
+
+    def query(self, t0=None, t1=None, dmin=None, dmax=None, max_gradient=None, min_duration=None):
+        ''' events overlapping [t0, t1] (days) and [dmin, dmax] (m), at most max_gradient, lasting at least min_duration (days) '''
+        ev = self.events
+        # sorted by start: events starting after t1 are cut by a binary search
+        if t1 is not None:
+            ev = ev[:np.searchsorted(ev['start'], t1, side='right')]
+        keep = np.ones(len(ev), bool)
+        if t0 is not None:
+            keep &= ev['end'] >= t0
+        if dmin is not None:
+            keep &= ev['bottom'] >= dmin
+        if dmax is not None:
+            keep &= ev['top'] <= dmax
+        if max_gradient is not None:
+            keep &= ev['min_gradient'] <= max_gradient
+        if min_duration is not None:
+            keep &= ev['end'] - ev['start'] >= min_duration
+        return ev[keep]
+
+    def save(self, path):
+        np.save(path, self.events)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+
+class EventDetector:
+    ''' streaming run-length encoding of gradient < threshold for every layer of a chain
+
+    Parameters:
+    -----------
+    :param 1: depths, nominal depths of the levels (any order, as the columns of the chunks)
+    :param 2: threshold (optional, default=0): gradients (degC/m) below it belong to an event
+    :param 3: min_samples (optional, default=1): shorter runs are discarded
+
+    update(time, temp) with consecutive (time x depth) chunks of a record, flush() at the end of
+    the record (e.g. deployment year) so no event spans two records
+    '''
+    def __init__(self, depths, threshold=0., min_samples=1):
+        self.depths = np.asarray(depths, dtype=float)
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.top, self.bottom = np.sort(self.depths)[:-1], np.sort(self.depths)[1:]
+        nlayer = len(self.top)
+        self._open = np.zeros(nlayer, bool) # layer in an event at the end of the last chunk
+        self._start = np.zeros(nlayer)
+        self._count = np.zeros(nlayer, int)
+        self._min = np.full(nlayer, np.inf)
+        self._last_time = None
+        self._events = []
+
+    def update(self, time, temp):
+        time = np.asarray(time, dtype=float)
+        if len(time) == 0:
+            return self
+        _, _, grad = vertical_gradient(temp, self.depths)
+        mask = grad < self.threshold # NaN are never in an event
+        # +1 where a run starts, -1 after its last sample, runs open at the chunk edges included
+        edges = np.diff(np.vstack([self._open, mask, np.zeros(len(self.top), bool)]).astype(np.int8), axis=0)
+        padded = np.vstack([np.where(mask, grad, np.inf), np.full(len(self.top), np.inf)])
+        for j in np.where(edges.any(axis=0))[0]:
+            starts, = np.where(edges[:, j] == 1)
+            stops, = np.where(edges[:, j] == -1)
+            if self._open[j]: # continuation of the run open at the end of the last chunk
+                starts = np.r_[0, starts]
+            if len(starts) == 0:
+                continue
+            mins = np.minimum.reduceat(padded[:, j], np.ravel(np.column_stack([starts, stops])))[::2]
+            counts = stops - starts
+            t_start = time[starts]
+            if self._open[j]:
+                mins[0] = min(mins[0], self._min[j])
+                counts[0] += self._count[j]
+                t_start[0] = self._start[j]
+            # the last run is still open if it reaches the end of the chunk
+            closed = stops < len(time)
+            if not closed[-1]:
+                self._start[j], self._count[j], self._min[j] = t_start[-1], counts[-1], mins[-1]
+            # a run carried over from the last chunk may close on the first sample: it ended on the last chunk
+            stops = stops[closed]
+            t_end = np.where(stops > 0, time[np.maximum(stops - 1, 0)], self._last_time)
+            self._emit(j, t_start[closed], t_end, mins[closed], counts[closed])
+        self._open = mask[-1]
+        self._last_time = time[-1]
+        return self
+
+    def _emit(self, j, start, end, mins, counts):
+        keep = counts >= self.min_samples
+        if not keep.any():
+            return
+        ev = np.zeros(keep.sum(), EVENT_DTYPE)
+        ev['start'], ev['end'], ev['min_gradient'], ev['samples'] = start[keep], end[keep], mins[keep], counts[keep]
+        ev['top'], ev['bottom'] = self.top[j], self.bottom[j]
+        self._events.append(ev)
+
+    def flush(self):
+        ''' close the events still open at the end of a record '''
+        for j in np.where(self._open)[0]:
+            self._emit(j, self._start[[j]], np.array([self._last_time]), self._min[[j]], self._count[[j]])
+        self._open[:] = False
+        return self
+
+    def index(self):
+        ''' EventIndex of the closed events '''
+        return EventIndex(np.concatenate(self._events) if self._events else None)
+
+
+def detect(md, instrument, years, threshold=0., min_samples=1, chunksize=2**16, var='TEMP'):
+    ''' EventIndex of a chain (MooringData md) over several years, read chunksize samples at a time '''
+    events = []
+    for year in years:
+        if not md.exists(instrument, year):
+            continue
+        block = md.lazy(instrument, year, var)
+        time = md.time(instrument, year)
+        det = EventDetector(block.depths, threshold, min_samples)
+        for i0 in range(0, len(time), chunksize):
+            det.update(time[i0:i0+chunksize], block[i0:i0+chunksize])
+        events.append(det.flush().index().events)
+    return EventIndex(np.concatenate(events) if events else None)
+
+
+def detect_archive(archive, years, threshold=0., min_samples=1, dmin=None, dmax=None, var='TEMP'):
+    ''' same as detect on a MooringArchive, chunk by chunk (memory mapped) '''
+    events = []
+    for year in years:
+        t0, t1 = archive.year_range(year)
+        det = None
+        for time, data in archive.chunks(var, t0, t1, dmin, dmax):
+            if det is None:
+                j0, j1 = archive._range(t0, t1, dmin, dmax)[2:]
+                det = EventDetector(archive.depths[j0:j1], threshold, min_samples)
+            det.update(time, data)
+        if det is not None:
+            events.append(det.flush().index().events)
+    return EventIndex(np.concatenate(events) if events else None)
@@ -0,0 +1,136 @@
+''' GIGATL model output co-located with the mooring instruments
+only the model levels bracketing the instrument depths and the time steps of a deployment are read,
+chunk by chunk, and interpolated vertically (model levels move with the free surface) to the nominal
+instrument depths. The (time x depth) subsets are cached as .npz, so later runs never open the model file;
+they have the layout of the mooring blocks and go through the same spectral and statistics stages
+
+E.g.
+    col = ModelColocation()
+    with MooringData('../netcdf') as md:
+        model = col.for_instrument(md, 'rbr', [2019])
+    freq, psd = stitched_psd(model[2019]['temp'], model[2019]['dt'], *BANDS['temperature'])
+'''
+import os
+import hashlib
+import json
+import numpy as np
+from netCDF4 import Dataset
+from stage_timing import stage, add_bytes
+
+MODEL_FILE = '../netcdf/Model/gigatl1_1h_tides_para_7063_lucky_mooring_64.nc'
+VARIABLES = ('temp', 'u', 'v')
+
+
+def model_time(nc):
+    ''' model time in days since 1950-01-01 (mooring convention) if the units are known, else days from the file origin '''
+    var = nc['time']
+    time = np.asarray(var[:], dtype=float)
+    units = getattr(var, 'units', None)
+    if units is None or 'since' not in units:
+        return time/86400. # seconds
+    from netCDF4 import num2date, date2num
+    dates = num2date(time, units, getattr(var, 'calendar', 'standard'))
+    return np.asarray(date2num(dates, 'days since 1950-01-01 00:00:00', getattr(var, 'calendar', 'standard')), dtype=float)
+
+
+def _column(var, i0, i1, k0, k1):
+    ''' (time x level) values of a (time, level[, y, x]) variable at the single model point '''
+    extra = (0,)*(var.ndim - 2)
+    return np.ma.filled(np.ma.asarray(var[(slice(i0, i1), slice(k0, k1)) + extra], dtype=float), np.nan)
+
+
+def interp_levels(zlev, values, depths):
+    ''' linear interpolation of (time x level) values at depths (m, positive down), zlev: (time x level)
+    level depths (positive down, any monotonic order). NaN outside the model column
+    '''
+    order = np.argsort(zlev[0])
+    zlev, values = zlev[:, order], values[:, order]
+    out = np.full((len(zlev), len(depths)), np.nan)
+    rows = np.arange(len(zlev))
+    for j, d in enumerate(depths):
+        k = (zlev < d).sum(axis=1) # levels above d
+        inside = (k > 0) & (k < zlev.shape[1])
+        k = np.clip(k, 1, zlev.shape[1] - 1)
+        z0, z1 = zlev[rows, k-1], zlev[rows, k]
+        w = (d - z0)/(z1 - z0)
+        out[:, j] = np.where(inside, (1 - w)*values[rows, k-1] + w*values[rows, k], np.nan)
+        out[zlev[:, -1] == d, j] = values[zlev[:, -1] == d, -1] # bottom level exactly
+    return out
+
+
+class ModelColocation:
+    ''' co-located model subsets of one model file, cached in cache_dir
+
+    Parameters:
+    -----------
+    :param 1: model_file (optional, default=MODEL_FILE)
+    :param 2: cache_dir (optional, default='../support_data/model')
+    :param 3: chunksize (optional, default=512): time steps read at once
+    '''
+    def __init__(self, model_file=MODEL_FILE, cache_dir='../support_data/model', chunksize=512):
+        self.model_file = model_file
+        self.cache_dir = cache_dir
+        self.chunksize = chunksize
+
+    def _cache_path(self, depths, t0, t1, variables):
+        st = os.stat(self.model_file)
+        key = json.dumps([os.path.abspath(self.model_file), st.st_size, int(st.st_mtime),
+                          [round(float(d), 2) for d in depths], t0, t1, list(variables)])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+    def extract(self, depths, t0=None, t1=None, variables=VARIABLES, refresh=False):
+        ''' {'time', 'depths', 'dt', var: (time x depth)} of the model at depths (m) in [t0, t1] (days, model_time)
+        read from the cache unless refresh
+        '''
+        depths = np.asarray(depths, dtype=float)
+        path = self._cache_path(depths, t0, t1, variables)
+        if os.path.exists(path) and not refresh:
+            with np.load(path) as f:
+                return {k: f[k] for k in f.files}
+        with Dataset(self.model_file, 'r') as nc, stage('read', source='model'):
+            time = model_time(nc)
+            i0 = 0 if t0 is None else int(np.searchsorted(time, t0, side='left'))
+            i1 = len(time) if t1 is None else int(np.searchsorted(time, t1, side='right'))
+            zvar = nc['z']
+            static = zvar.ndim == 1
+            zfirst = -np.asarray(zvar[:] if static else _column(zvar, i0, i0 + 1, 0, zvar.shape[1])[0], dtype=float)
+            # levels bracketing the instrument depths, two more on each side for the free surface motion
+            order = np.argsort(zfirst)
+            lo = max(int(np.searchsorted(zfirst[order], depths.min())) - 2, 0)
+            hi = min(int(np.searchsorted(zfirst[order], depths.max())) + 2, len(order))
+            k0, k1 = int(order[lo:hi].min()), int(order[lo:hi].max()) + 1
+            res = {'time': time[i0:i1], 'depths': depths,
+                   'dt': float(np.median(np.diff(time))) if len(time) > 1 else np.nan}
+            for var in variables:
+                res[var] = np.full((max(i1 - i0, 0), len(depths)), np.nan)
+            for c0 in range(i0, i1, self.chunksize):
+                c1 = min(c0 + self.chunksize, i1)
+                zlev = -(np.broadcast_to(np.asarray(zvar[k0:k1], dtype=float), (c1 - c0, k1 - k0)) if static
+                         else _column(zvar, c0, c1, k0, k1))
+                for var in variables:
+                    values = _column(nc[var], c0, c1, k0, k1)
+                    add_bytes(values.nbytes)
+                    res[var][c0 - i0:c1 - i0] = interp_levels(zlev, values, depths)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **res)
+        os.replace(tmp, path)
+        return res
+
+    def for_instrument(self, md, instrument, years, variables=VARIABLES, match_time=True, refresh=False):
+        ''' {year: extract(...)} at the depths and over the deployment period of an instrument (MooringData md)
+        years without overlap with the model are left out. match_time=False takes the whole model run
+        (e.g. the simulated period is not a deployment period, or the model time has no units)
+        '''
+        out = {}
+        for year in years:
+            if not md.exists(instrument, year):
+                continue
+            t0 = t1 = None
+            if match_time:
+                time = md.time(instrument, year)
+                t0, t1 = float(np.nanmin(time)), float(np.nanmax(time))
+            res = self.extract(md.depths(instrument, year), t0, t1, variables, refresh)
+            if len(res['time']):
+                out[year] = res
+        return out
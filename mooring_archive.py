@@ -0,0 +1,151 @@
+''' consolidated multi-year archive of the mooring record, one per instrument
+the per-year netcdf files (different sampling intervals, different levels) are converted once into
+fixed-size (time x depth) chunks sharing a global time index and depth coordinate. Chunks are .npy
+files opened with memory mapping, so a time/depth query only touches the chunks it overlaps and a
+query within one chunk is a view (no copy). compress=True stores zlib-compressed .npz chunks instead
+(about 2x smaller, decompressed chunk by chunk, no memory mapping)
+
+layout:
+    archive_dir/{instrument}/meta.json      depths, variables, chunk table (year, dt, start, stop)
+    archive_dir/{instrument}/time.npy       global time index (days since 1950-01-01)
+    archive_dir/{instrument}/{var}_{k}.npy  chunk k of a variable, (time x depth)
+
+E.g.
+    ingest('rbr', range(2011, 2020), '../netcdf', '../archive')
+    arc = MooringArchive('../archive', 'rbr')
+    time, depths, temp = arc.select('TEMP', t0, t1, dmin=900, dmax=1200)
+'''
+import os
+import json
+import numpy as np
+from mooring_data import MooringData
+
+VARIABLES = {'rbr': ['TEMP'], 'sbe': ['TEMP', 'PSAL', 'PRES'], 'aquadopp': ['HCSP', 'HCDT']}
+
+
+def _depth_coordinate(depths_per_year, tolerance):
+    ''' sorted global depths: levels of different years closer than tolerance are merged '''
+    coord = []
+    for d in np.sort(np.concatenate(depths_per_year)):
+        if not coord or d - coord[-1] > tolerance:
+            coord.append(d)
+    return np.array(coord)
+
+
+def ingest(instrument, years, netcdf_dir, archive_dir, variables=None, chunk_len=2**18,
+           depth_tolerance=0.5, dtype='float32', compress=False, verbose=True):
+    ''' convert the per-year netcdf files of an instrument into one chunked archive (overwrites it)
+
+    Parameters:
+    -----------
+    :param 1: instrument, 'rbr', 'sbe' or 'aquadopp'
+    :param 2: years, deployment years (missing files are skipped)
+    :param 3: netcdf_dir, root of the {year}/{file}.nc tree
+    :param 4: archive_dir, root of the archives
+    :param 5: variables (optional): variables to store, default VARIABLES[instrument]
+    :param 6: chunk_len (optional, default=2**18): time samples per chunk
+    :param 7: depth_tolerance (optional, default=0.5): levels closer than this (m) share a column
+    :param 8: dtype (optional, default='float32'): storage type
+    :param 9: compress (optional, default=False): zlib-compressed chunks (not memory mappable)
+    '''
+    variables = variables or VARIABLES[instrument]
+    out_dir = os.path.join(archive_dir, instrument)
+    os.makedirs(out_dir, exist_ok=True)
+    md = MooringData(netcdf_dir)
+    years = [str(y) for y in sorted(years, key=int) if md.exists(instrument, y)]
+    depths = _depth_coordinate([md.depths(instrument, y) for y in years], depth_tolerance)
+
+    chunks, times = [], []
+    start = 0
+    for year in years:
+        level_depths = md.depths(instrument, year)
+        columns = np.array([np.argmin(abs(depths - d)) if not np.isnan(d) else 0 for d in level_depths])
+        # sbe levels are separate groups of different lengths: the longest TIME is the time base,
+        # the shorter levels must be a prefix of it (padded with NaN), anything else is refused
+        level_times = [t for t in (md.time(instrument, year, level) for level in range(len(level_depths)))
+                       if t is not None]
+        time = max(level_times, key=len)
+        dt = float(np.nanmedian(np.diff(time))) if len(time) > 1 else np.nan
+        for t in level_times:
+            if not np.allclose(t, time[:len(t)], atol=0.5*dt if dt > 0 else 0., equal_nan=True):
+                raise ValueError(f'{instrument} {year}: levels do not share one time base, cannot be archived together')
+        times.append(time)
+        for c0 in range(0, len(time), chunk_len):
+            c1 = min(c0 + chunk_len, len(time))
+            k = len(chunks)
+            for var in variables:
+                block = np.full((c1 - c0, len(depths)), np.nan, dtype=dtype)
+                for level, col in enumerate(columns):
+                    values = md.read(instrument, year, var, level=level, start=c0, stop=c1)
+                    if values is not None:
+                        block[:len(values), col] = values
+                name = os.path.join(out_dir, f'{var}_{k}')
+                if compress:
+                    np.savez_compressed(name + '.npz', data=block)
+                else:
+                    np.save(name + '.npy', block)
+            chunks.append({'year': year, 'dt': dt, 'start': start + c0, 'stop': start + c1})
+            if verbose:
+                print(f'{instrument} {year}: chunk {k} ({c1 - c0} samples)')
+        start += len(time)
+    md.close()
+
+    np.save(os.path.join(out_dir, 'time.npy'), np.concatenate(times) if times else np.array([]))
+    meta = {'instrument': instrument, 'years': years, 'variables': variables, 'depths': depths.tolist(),
+            'dtype': dtype, 'compress': compress, 'chunks': chunks}
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class MooringArchive:
+    ''' read access to an archive written by ingest() '''
+    def __init__(self, archive_dir, instrument):
+        self.path = os.path.join(archive_dir, instrument)
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.depths = np.array(self.meta['depths'])
+        self.time = np.load(os.path.join(self.path, 'time.npy'), mmap_mode='r')
+        self.bounds = np.array([c['start'] for c in self.meta['chunks']] + [len(self.time)])
+
+    def chunk(self, var, k):
+        ''' (time x depth) chunk k, memory mapped unless the archive is compressed '''
+        name = os.path.join(self.path, f'{var}_{k}')
+        if self.meta['compress']:
+            with np.load(name + '.npz') as f:
+                return f['data']
+        return np.load(name + '.npy', mmap_mode='r')
+
+    def _range(self, t0, t1, dmin, dmax):
+        i0 = 0 if t0 is None else int(np.searchsorted(self.time, t0, side='left'))
+        i1 = len(self.time) if t1 is None else int(np.searchsorted(self.time, t1, side='right'))
+        j0 = 0 if dmin is None else int(np.searchsorted(self.depths, dmin, side='left'))
+        j1 = len(self.depths) if dmax is None else int(np.searchsorted(self.depths, dmax, side='right'))
+        return i0, i1, j0, j1
+
+    def chunks(self, var, t0=None, t1=None, dmin=None, dmax=None):
+        ''' generator of (time, data) pieces (views) of the chunks overlapping [t0, t1] x [dmin, dmax] '''
+        i0, i1, j0, j1 = self._range(t0, t1, dmin, dmax)
+        if i1 <= i0:
+            return
+        k0 = int(np.searchsorted(self.bounds, i0, side='right')) - 1
+        k1 = int(np.searchsorted(self.bounds, i1 - 1, side='right')) - 1
+        for k in range(k0, k1 + 1):
+            s0, s1 = max(i0, self.bounds[k]), min(i1, self.bounds[k + 1])
+            data = self.chunk(var, k)
+            yield self.time[s0:s1], data[s0 - self.bounds[k]:s1 - self.bounds[k], j0:j1]
+
+    def select(self, var, t0=None, t1=None, dmin=None, dmax=None):
+        ''' time, depths and (time x depth) data in [t0, t1] (days since 1950) x [dmin, dmax] (m)
+        a view of the chunk if the range lies in a single chunk, else the pieces are concatenated
+        '''
+        i0, i1, j0, j1 = self._range(t0, t1, dmin, dmax)
+        pieces = list(self.chunks(var, t0, t1, dmin, dmax))
+        if not pieces:
+            return self.time[i0:i0], self.depths[j0:j1], np.empty((0, j1 - j0))
+        data = pieces[0][1] if len(pieces) == 1 else np.concatenate([p[1] for p in pieces])
+        return self.time[i0:i1], self.depths[j0:j1], data
+
+    def year_range(self, year):
+        ''' (t0, t1) of a deployment year '''
+        chunks = [c for c in self.meta['chunks'] if c['year'] == str(year)]
+        return float(self.time[chunks[0]['start']]), float(self.time[chunks[-1]['stop'] - 1])
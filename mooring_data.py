@@ -0,0 +1,253 @@
+''' lazy access to the mooring netcdf files ({netcdf_dir}/{year}/rbr.nc, sbe.nc, sbe_1000m.nc, ...)
+every file is seen as a (time x depth) array read by slices, depth levels are selected with a
+sorted index instead of scanning range(i_level - tolerance, i_level + tolerance), open files and
+recently read blocks are kept in small LRU caches
+
+E.g.
+    md = MooringData('../netcdf')
+    temp = md.read('sbe', 2015, 'TEMP', depth=1000, tolerance=10)  # only this level is read
+    block = md.lazy('rbr', 2015, 'TEMP')[:5760, 2:6]                # first day, 4 levels
+'''
+import os
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+import stage_timing
+
+FILES = {'rbr': 'rbr.nc', 'sbe': 'sbe.nc', 'sbe_1000m': 'sbe_1000m.nc', 'sbe_1688m': 'sbe_1688m.nc',
+         'aquadopp': 'aquadopp.nc'}
+
+
+class _LRU(OrderedDict):
+    ''' ordered dict dropping its least recently used items above maxsize (calling on_drop) '''
+    def __init__(self, maxsize, on_drop=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            _, old = self.popitem(last=False)
+            if self.on_drop is not None:
+                self.on_drop(old)
+
+
+def _filled(values):
+    ''' masked netcdf values to a float ndarray with NaN '''
+    return np.ma.filled(np.ma.asarray(values).astype(float), np.nan)
+
+
+class MooringData:
+    ''' lazy (time x depth) view of the mooring netcdf files
+
+    Parameters:
+    -----------
+    :param 1: netcdf_dir, root of the {year}/{file}.nc tree
+    :param 2: max_open (optional, default=8): number of netcdf files kept open
+    :param 3: block_size (optional, default=65536): time samples per cached block
+    :param 4: max_blocks (optional, default=32): number of cached blocks
+    '''
+    def __init__(self, netcdf_dir='../netcdf', max_open=8, block_size=2**16, max_blocks=32):
+        self.netcdf_dir = netcdf_dir
+        self.block_size = block_size
+        self._files = _LRU(max_open, on_drop=lambda nc: nc.close())
+        self._blocks = _LRU(max_blocks)
+        self._levels = {}
+
+    def path(self, instrument, year):
+        return os.path.join(self.netcdf_dir, str(year), FILES[instrument])
+
+    def exists(self, instrument, year):
+        return os.path.exists(self.path(instrument, year))
+
+    def dataset(self, instrument, year):
+        ''' open netCDF4.Dataset of an instrument/year (cached, do not close it) '''
+        key = (instrument, str(year))
+        nc = self._files.get(key)
+        if nc is None:
+            nc = Dataset(self.path(instrument, year), 'r')
+            self._files.put(key, nc)
+        return nc
+
+    def close(self):
+        for nc in self._files.values():
+            nc.close()
+        self._files.clear()
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ---- depth index
+    def _level_index(self, instrument, year):
+        ''' (sorted depths, level of each sorted depth), built once per file '''
+        key = (instrument, str(year))
+        if key not in self._levels:
+            nc = self.dataset(instrument, year)
+            if 'DEPTH' in nc.variables:
+                depths = np.atleast_1d(_filled(nc['DEPTH'][:]))
+            else:
+                depths = np.array([np.nan])
+            order = np.argsort(depths, kind='stable')
+            self._levels[key] = (depths[order], order)
+        return self._levels[key]
+
+    def depths(self, instrument, year):
+        ''' nominal depths of the levels, in file order '''
+        sorted_depths, order = self._level_index(instrument, year)
+        depths = np.empty_like(sorted_depths)
+        depths[order] = sorted_depths
+        return depths
+
+    def nearest_level(self, instrument, year, depth, tolerance=None):
+        ''' level index (file order) of the nearest depth, None if further than tolerance '''
+        sorted_depths, order = self._level_index(instrument, year)
+        i = np.searchsorted(sorted_depths, depth)
+        j = min([c for c in (i-1, i) if 0 <= c < len(sorted_depths)], key=lambda c: abs(sorted_depths[c] - depth))
+        if tolerance is not None and not abs(sorted_depths[j] - depth) <= tolerance:
+            return None
+        return int(order[j])
+
+    def _group_names(self, instrument, year):
+        ''' {level: group name}, sbe files have one group per depth named after the depth '''
+        key = ('groups', instrument, str(year))
+        if key not in self._levels:
+            depths = self.depths(instrument, year)
+            names = {}
+            for name in self.dataset(instrument, year).groups:
+                try:
+                    match, = np.where(np.isclose(depths, float(name)))
+                except ValueError:
+                    continue
+                if len(match):
+                    names[int(match[0])] = name
+            self._levels[key] = names
+        return self._levels[key]
+
+    # ---- variables
+    def _variable(self, instrument, year, var, level):
+        ''' netcdf variable and column holding one level (column None: 1D variable) '''
+        nc = self.dataset(instrument, year)
+        if instrument == 'sbe':
+            name = self._group_names(instrument, year).get(level)
+            if name is None or var not in nc[name].variables:
+                return None, None
+            return nc[name][var], None
+        if var not in nc.variables:
+            return None, None
+        v = nc[var]
+        return v, (level if v.ndim == 2 else None)
+
+    def has(self, instrument, year, var, level):
+        return self._variable(instrument, year, var, level)[0] is not None
+
+    def length(self, instrument, year, var='TEMP', level=0):
+        v, _ = self._variable(instrument, year, var, level)
+        return 0 if v is None else v.shape[0]
+
+    def _block(self, instrument, year, var, level, ib):
+        key = (instrument, str(year), var, level, ib)
+        block = self._blocks.get(key)
+        if block is None:
+            v, col = self._variable(instrument, year, var, level)
+            sl = slice(ib*self.block_size, (ib+1)*self.block_size)
+            block = _filled(v[sl] if col is None else v[sl, col])
+            stage_timing.add_bytes(block.nbytes)
+            self._blocks.put(key, block)
+        return block
+
+    def read(self, instrument, year, var='TEMP', depth=None, level=None, tolerance=None, start=0, stop=None):
+        ''' 1D series of one level (by depth, nearest within tolerance, or by level index), NaN for masked values
+        only the blocks covering [start, stop) are read. Returns None if the level or variable does not exist
+        '''
+        if level is None:
+            level = 0 if depth is None else self.nearest_level(instrument, year, depth, tolerance)
+            if level is None:
+                return None
+        v, _ = self._variable(instrument, year, var, level)
+        if v is None:
+            return None
+        start, stop, _ = slice(start, stop).indices(v.shape[0])
+        if stop <= start:
+            return np.array([])
+        b0, b1 = start//self.block_size, (stop-1)//self.block_size
+        blocks = [self._block(instrument, year, var, level, ib) for ib in range(b0, b1+1)]
+        out = blocks[0].copy() if len(blocks) == 1 else np.concatenate(blocks) # never hand out the cached blocks
+        offset = b0*self.block_size
+        return out[start-offset:stop-offset]
+
+    def time(self, instrument, year, level=0):
+        ''' time (days since 1950-01-01) '''
+        return self.read(instrument, year, 'TIME', level=level)
+
+    def block_time(self, instrument, year):
+        ''' TIME of the longest level, the time base of lazy() blocks (shorter levels are padded), None without TIME '''
+        lengths = [self.length(instrument, year, 'TIME', level) for level in range(len(self.depths(instrument, year)))]
+        if not any(lengths):
+            return None
+        return self.time(instrument, year, int(np.argmax(lengths)))
+
+    def sampling_interval(self, instrument, year, level=0, n=4096):
+        ''' sampling interval (days) from the TIME of a level: median step of the first n samples, rounded to the second '''
+        time = self.read(instrument, year, 'TIME', level=level, stop=n)
+        if time is None or len(time) < 2:
+            return None
+        return np.round(np.nanmedian(np.diff(time))*86400)/86400
+
+    def lazy(self, instrument, year, var='TEMP', length=None):
+        ''' (time x depth) LazyBlock, nothing is read before slicing (length: pad to this number of samples) '''
+        return LazyBlock(self, instrument, year, var, length=length)
+
+
+class LazyBlock:
+    ''' (time x depth) array-like over a MooringData file, read by slices: block[t0:t1, levels]
+    levels with a shorter record (or without the variable) are padded with NaN
+    '''
+    def __init__(self, data, instrument, year, var, length=None):
+        self.data = data
+        self.instrument, self.year, self.var = instrument, year, var
+        self.depths = data.depths(instrument, year)
+        nt = [data.length(instrument, year, var, level) for level in range(len(self.depths))]
+        self.shape = (max(nt, default=0) if length is None else length, len(self.depths))
+        self.ndim = 2
+        self.dtype = np.dtype(float)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        tkey, dkey = key
+        levels = np.arange(self.shape[1])[dkey]
+        scalar_level = np.ndim(levels) == 0
+        levels = np.atleast_1d(levels)
+        if isinstance(tkey, slice) and tkey.step in (None, 1):
+            start, stop, _ = tkey.indices(self.shape[0])
+            tsel = slice(None)
+        else:
+            tind = np.arange(self.shape[0])[tkey]
+            start, stop = int(np.min(tind)), int(np.max(tind))+1
+            tsel = tind - start
+        out = np.full((max(stop-start, 0), len(levels)), np.nan)
+        for j, level in enumerate(levels):
+            col = self.data.read(self.instrument, self.year, self.var, level=int(level), start=start, stop=stop)
+            if col is not None:
+                out[:len(col), j] = col
+        out = out[tsel]
+        return out[..., 0] if scalar_level else out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:, :]
+        return out if dtype is None else out.astype(dtype)
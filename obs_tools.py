@@ -4,69 +4,168 @@ NJAL Dec 2017'''
 from __future__ import print_function, division
 import numpy as np
 from scipy import stats, signal
-import obs_tools as otools
+from stage_timing import timed
 
 
-def lowfreq_filt(data,fcut,mode='lowpass',use_gust=False,reduce_size=False,verbose=False):
+@timed('filter')
+def lowfreq_filt(data,fcut,mode='lowpass',use_gust=False,reduce_size=False,verbose=False,axis=-1,chunksize=None):
     ''' iterative subsampling with lowpass filtering at each step 
     avoid numerical errors when filtering frequency is low compared to sample frequency
     input fcut is relative cutoff frequency (cycle/time_interval), not Nyquist
-    Procedure to reduce the number of points in the output is not optimal
+    filters are applied forward-backward in second-order sections
     
     Parameters:
     -----------
     :param 1: data, time series to filter
-    :type 1: numpy ndarray (rank 1)
+    :type 1: numpy ndarray (rank 1, or rank 2 e.g. time x depth, see axis) or any sliceable array (netCDF variable, memmap) if chunksize is set
     
     :param 2: fcut: relative cutoff frequency (cycle/time_interval) -> f/fsample
     :type 2: float, scalar or 2-elements ndarray (if mode=='bandpass')
     
     :param 3: mode (optional, default: 'lowpass'): filter mode for last pass
-    :type 3: str ('lowpass','bandpass','highpass' (stupid)) -> argument of scipy.signal.filtfilt
+    :type 3: str ('lowpass','bandpass','highpass' (stupid)) -> argument of scipy.signal.butter
     
     :param 4: use_gust (optional, default=True): whether to use gustaffson's method or not at the edges (requires scipy>=0.16.0)
     :type 4: boolean
     
-    :param 5: reduce_size (default:False): retain smallest number of points in the output
+    :param 5: reduce_size (default:False): retain smallest number of points in the output,
+              i.e. subsample the filtered series at the Nyquist rate of the cutoff frequency (lowpass and bandpass)
     :type 5: boolean
     
     :param 6: verbose (optional, default=False): activate verbose mode
     :type 6: boolean
+
+    :param 7: axis (optional, default=-1): time axis of data
+    :type 7: int
+
+    :param 8: chunksize (optional, default=None): if set, stream the input by chunks of chunksize samples,
+              memory then scales with chunksize and the output size only (see lowfreq_filt_chunks)
+    :type 8: int
     
     Returned:
     ---------
     :return: data, indices: time series of filtered data and indices of sampling points w.r.t input data
-    :rtype: ndarray (rank 1), ndarray (rank 1)
+    :rtype: ndarray (same rank as data), ndarray (rank 1)
     
     '''
-    Nt = len(data)
-    if mode=='bandpass':
-        freq = np.sqrt(fcut.prod())
-    else:
-        freq = fcut
-    nsub = int(np.log10(1./freq))-1
+    if chunksize is not None:
+        pieces = list(lowfreq_filt_chunks(data,fcut,chunksize,mode=mode,reduce_size=reduce_size,verbose=verbose,axis=axis))
+        if not pieces:
+            return np.array([]), np.array([],dtype=int)
+        return (np.concatenate([p[0] for p in pieces],axis=axis),
+                np.concatenate([p[1] for p in pieces]))
+
+    data = np.asarray(data)
+    Nt = data.shape[axis]
+    nsub, fcut, step = _subsampling(fcut,mode,reduce_size,verbose)
     # down sampling (with lowpass filter at 1/10)
     if nsub >= 1:
-        bb,aa = signal.butter(4,0.1,'lowpass')
+        sos = signal.butter(4,0.1,'lowpass',output='sos')
         for ii in range(nsub):
-            data = signal.filtfilt(bb,aa,data)
-            data = data[::10]
-        fcut = fcut*10**nsub
-    else:
-        nsub = 0
-    if verbose:
-        print('subsampling {0} times before filtering at {1}'.format(nsub,freq*10**nsub))
-    bb,aa = signal.butter(4,2.*fcut,mode)
+            data = signal.sosfiltfilt(sos,data,axis=axis)
+            data = np.take(data,np.arange(0,data.shape[axis],10),axis=axis)
     if use_gust:
-        meth = 'gust'
         print('WARNING: using gustafsson but it is not well implemented here... avoid')
+        bb,aa = signal.butter(4,2.*fcut,mode)
+        data = signal.filtfilt(bb,aa,data,axis=axis,method='gust')
     else:
-        meth = 'pad'
-    data = signal.filtfilt(bb,aa,data,method=meth)
-    if reduce_size:
-        return data[::2], np.arange(0,Nt,10**nsub*2) # this is clearly not optimal
+        data = signal.sosfiltfilt(signal.butter(4,2.*fcut,mode,output='sos'),data,axis=axis)
+    if step > 1:
+        data = np.take(data,np.arange(0,data.shape[axis],step),axis=axis)
+    return data, np.arange(data.shape[axis])*10**nsub*step
+
+def lowfreq_filt_chunks(data,fcut,chunksize,mode='lowpass',reduce_size=False,verbose=False,axis=-1):
+    ''' streaming version of lowfreq_filt: generator of (filtered chunk, indices w.r.t input data)
+    the input is read by chunks of chunksize samples along axis (works on netCDF variables or memmaps),
+    each pass of the cascade runs forward with its state carried across chunks, then backward with a
+    lookahead long enough for the filter response to decay, so the result matches lowfreq_filt
+    '''
+    Nt = data.shape[axis]
+    nsub, fcut, step = _subsampling(fcut,mode,reduce_size,verbose)
+    def reader():
+        for i0 in range(0,Nt,chunksize):
+            sl = [slice(None)]*len(data.shape)
+            sl[axis] = slice(i0,min(i0+chunksize,Nt))
+            yield np.moveaxis(np.asarray(data[tuple(sl)],dtype=float),axis,0)
+    chunks = reader()
+    sos = signal.butter(4,0.1,'lowpass',output='sos')
+    for ii in range(nsub):
+        chunks = _subsample(_sosfiltfilt_stream(chunks,sos),10)
+    chunks = _sosfiltfilt_stream(chunks,signal.butter(4,2.*fcut,mode,output='sos'))
+    i0 = 0
+    for chunk in _subsample(chunks,step):
+        yield np.moveaxis(chunk,0,axis), (i0+np.arange(len(chunk)))*10**nsub*step
+        i0 += len(chunk)
+
+def _subsampling(fcut,mode,reduce_size,verbose):
+    ''' number of x10 subsampling passes, cutoff frequency after them and final output step '''
+    fcut = np.asarray(fcut,dtype=float)
+    if mode=='bandpass':
+        freq = np.sqrt(fcut.prod())
     else:
-        return data, np.arange(0,Nt,10**nsub)
+        freq = float(fcut)
+    nsub = max(int(np.log10(1./freq))-1, 0)
+    fcut = fcut*10**nsub
+    if verbose:
+        print('subsampling {0} times before filtering at {1}'.format(nsub,freq*10**nsub))
+    step = 1
+    if reduce_size and mode!='highpass':
+        step = max(int(0.5/fcut.max()),1)
+    return nsub, fcut, step
+
+def _subsample(chunks,step):
+    ''' keep one sample every step along the first axis of a stream of chunks '''
+    i0 = 0
+    for chunk in chunks:
+        yield chunk[(-i0)%step::step]
+        i0 += len(chunk)
+
+def _sosfiltfilt_stream(chunks,sos,tol=1e-12):
+    ''' forward-backward filtering of a stream of chunks (time along first axis)
+    same edge treatment as signal.sosfiltfilt (odd extension), the backward pass uses a lookahead of
+    forward-filtered samples over which the filter impulse response decays below tol
+    '''
+    ntaps = 2*len(sos)+1 - min((sos[:,2]==0).sum(),(sos[:,5]==0).sum())
+    padlen = 3*ntaps
+    rmax = max(np.abs(np.roots(s[3:])).max() for s in sos)
+    lookahead = int(np.ceil(np.log(tol)/np.log(rmax)))+padlen
+    zi = signal.sosfilt_zi(sos)
+
+    head = None # first samples, until padlen+1 are available for the odd extension
+    fwd = None  # forward-filtered samples not emitted yet
+    tail = None # last padlen+1 input samples for the odd extension at the end
+    zf = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if zf is None:
+            head = chunk if head is None else np.concatenate((head,chunk))
+            if len(head) <= padlen:
+                continue
+            chunk, head = head, None
+            ext = 2*chunk[0] - chunk[padlen:0:-1]
+            _, zf = signal.sosfilt(sos,ext,axis=0,zi=_zi_times(zi,ext[0]))
+        y, zf = signal.sosfilt(sos,chunk,axis=0,zi=zf)
+        fwd = y if fwd is None else np.concatenate((fwd,y))
+        tail = chunk[-(padlen+1):] if tail is None else np.concatenate((tail,chunk))[-(padlen+1):]
+        if len(fwd) > 2*lookahead:
+            back = signal.sosfilt(sos,fwd[::-1],axis=0)[::-1]
+            yield back[:len(fwd)-lookahead]
+            fwd = fwd[len(fwd)-lookahead:]
+    if zf is None:
+        if head is not None: # too short to stream: fall back on the direct computation
+            yield signal.sosfiltfilt(sos,head,axis=0,padlen=len(head)-1)
+        return
+    ext = 2*tail[-1] - tail[-2::-1]
+    yext, _ = signal.sosfilt(sos,ext,axis=0,zi=zf)
+    fwd = np.concatenate((fwd,yext))
+    back, _ = signal.sosfilt(sos,fwd[::-1],axis=0,zi=_zi_times(zi,fwd[-1]))
+    yield back[len(ext):][::-1]
+
+def _zi_times(zi,x0):
+    ''' initial conditions of sosfilt for steady state at x0 (scalar or array of channels) '''
+    x0 = np.asarray(x0)
+    return zi.reshape(zi.shape+(1,)*x0.ndim)*x0
 
 def mystats(data,nbins=None,bnd_bins=None):
     ''' return every statistical information you need in a dictionnary
@@ -110,7 +209,246 @@ def mystats(data,nbins=None,bnd_bins=None):
     
     return res
 
-                                     
+
+class RunningStats(object):
+    ''' single-pass, mergeable statistics of (time x channels) series, NaN are ignored
+    accumulates count, mean, central moments (up to 4th order), min, max and a fixed-bin histogram,
+    accumulators of different chunks or years merge exactly (Chan et al. / Pebay pairwise formulas)
+
+    E.g.
+        acc = RunningStats(bins=np.linspace(2,14,101))
+        for year in years:
+            acc.update(temp[year], axis=0)   # temp[year]: time x depth
+        res = acc.result()                   # same keys as mystats, one value per depth
+
+    or one accumulator per year and RunningStats.merge(...) when needed
+    '''
+    def __init__(self,bins=None):
+        self.bins = None if bins is None else np.asarray(bins,dtype=float)
+        self.n = None
+
+    def _init(self,shape):
+        self.n = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.m3 = np.zeros(shape)
+        self.m4 = np.zeros(shape)
+        self.min = np.full(shape,np.inf)
+        self.max = np.full(shape,-np.inf)
+        if self.bins is not None:
+            self.hist = np.zeros(shape+(len(self.bins)-1,))
+
+    def update(self,data,axis=0):
+        ''' add a chunk of data, time along axis '''
+        data = np.moveaxis(np.asarray(data,dtype=float),axis,0)
+        other = RunningStats(self.bins)
+        other._init(data.shape[1:])
+        valid = ~np.isnan(data)
+        other.n = valid.sum(axis=0).astype(float)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            other.mean = np.where(other.n>0,np.nansum(data,axis=0)/other.n,0.)
+        dev = np.where(valid,data-other.mean,0.)
+        dev2 = dev*dev
+        other.m2 = dev2.sum(axis=0)
+        other.m3 = (dev2*dev).sum(axis=0)
+        other.m4 = (dev2*dev2).sum(axis=0)
+        if data.shape[0] > 0:
+            other.min = np.fmin(other.min,np.nanmin(np.where(valid,data,np.inf),axis=0))
+            other.max = np.fmax(other.max,np.nanmax(np.where(valid,data,-np.inf),axis=0))
+        if self.bins is not None:
+            other.hist = self._histogram(data,valid)
+        return self.merge(other)
+
+    def _histogram(self,data,valid):
+        ''' counts per bin and channel in one bincount, same bin convention as np.histogram '''
+        nb = len(self.bins)-1
+        ind = np.searchsorted(self.bins,data,side='right')-1
+        ind[data==self.bins[-1]] = nb-1 # last bin is closed
+        ok = valid & (ind>=0) & (ind<nb)
+        nchan = int(np.prod(data.shape[1:]))
+        chan = np.broadcast_to(np.arange(nchan).reshape(data.shape[1:]),data.shape)
+        counts = np.bincount((chan*nb+ind)[ok],minlength=nchan*nb)
+        return counts.reshape(data.shape[1:]+(nb,)).astype(float)
+
+    def merge(self,other):
+        ''' merge another accumulator (same bins) in place, returns self '''
+        if other.n is None:
+            return self
+        if self.n is None:
+            self._init(other.n.shape)
+        na, nb = self.n, other.n
+        n = na+nb
+        with np.errstate(invalid='ignore',divide='ignore'):
+            delta = np.where(n>0,other.mean-self.mean,0.)
+            fa = np.where(n>0,na/n,0.)
+            fb = np.where(n>0,nb/n,0.)
+            m2 = self.m2+other.m2+delta**2*na*fb
+            m3 = (self.m3+other.m3+delta**3*na*fb*(fa-fb)
+                  +3*delta*(fa*other.m2-fb*self.m2))
+            m4 = (self.m4+other.m4+delta**4*na*fb*(fa**2-fa*fb+fb**2)
+                  +6*delta**2*(fa**2*other.m2+fb**2*self.m2)
+                  +4*delta*(fa*other.m3-fb*self.m3))
+        self.mean = self.mean+delta*fb
+        self.n, self.m2, self.m3, self.m4 = n, m2, m3, m4
+        self.min = np.fmin(self.min,other.min)
+        self.max = np.fmax(self.max,other.max)
+        if self.bins is not None:
+            self.hist = self.hist+other.hist
+        return self
+
+    def result(self):
+        ''' dictionnary with the keys of mystats (mean, std, skew, kurt, and pdf, bins, binplt if bins are set)
+        plus count, min and max. Same conventions as stats.describe: unbiased variance, biased skewness
+        and (Fisher) kurtosis. The pdf is normalized by the number of valid points
+        '''
+        res = {}
+        with np.errstate(invalid='ignore',divide='ignore'):
+            n = np.where(self.n>0,self.n,np.nan)
+            res['count'] = self.n
+            res['mean'] = np.where(self.n>0,self.mean,np.nan)
+            res['std'] = np.sqrt(self.m2/(n-1))
+            res['skew'] = np.sqrt(n)*self.m3/self.m2**1.5
+            res['kurt'] = n*self.m4/self.m2**2-3.
+            res['min'] = np.where(self.n>0,self.min,np.nan)
+            res['max'] = np.where(self.n>0,self.max,np.nan)
+            if self.bins is not None:
+                res['bins'] = self.bins
+                res['binplt'] = 0.5*(self.bins[:-1]+self.bins[1:])
+                res['pdf'] = self.hist/((self.bins[2]-self.bins[1])*n[...,None])
+        if np.ndim(self.n) == 0:
+            res = {key: (val[()] if isinstance(val,np.ndarray) and val.ndim==0 else val) for key,val in res.items()}
+        return res
+
+class BinnedStats(object):
+    ''' single-pass statistics of a value (e.g. Aquadopp speed HCSP) in bins of a reference (e.g. direction HCDT)
+    every sample gets an integer bin index once, then counts, sums and deviations are bincounts:
+    count, mean and variance per reference bin, joint (reference x value) histogram (current rose) and
+    histogram quantiles of the value per reference bin (resolution: value bin width).
+    period (e.g. 360 for HCDT in degrees, 2*pi in radians) wraps the reference into [bins[0], bins[0]+period).
+    Accumulators of different chunks or years merge exactly
+
+    E.g.
+        acc = BinnedStats(np.linspace(0,360,101),value_bins=np.linspace(0,0.5,51),period=360)
+        for year in years:
+            acc.update(hcdt[year],hcsp[year])
+        res = acc.result()   # count, mean, std, hist2d, circmean (per value bin), ...
+        acc.quantiles([0.5,0.9])
+    '''
+    def __init__(self,bins,value_bins=None,period=None):
+        self.bins = np.asarray(bins,dtype=float)
+        self.value_bins = None if value_bins is None else np.asarray(value_bins,dtype=float)
+        self.period = period
+        nb = len(self.bins)-1
+        self.n = np.zeros(nb)
+        self.mean = np.zeros(nb)
+        self.m2 = np.zeros(nb)
+        if self.value_bins is not None:
+            nv = len(self.value_bins)-1
+            self.hist2d = np.zeros((nb,nv))
+            if period is not None: # resultant vector of the reference per value bin
+                self.cos = np.zeros(nv)
+                self.sin = np.zeros(nv)
+
+    @staticmethod
+    def _index(bins,data):
+        ''' bin index, -1 outside the bins or NaN (same convention as np.histogram, last bin closed) '''
+        ind = np.searchsorted(bins,data,side='right')-1
+        ind[data==bins[-1]] = len(bins)-2
+        ind[(ind<0) | (ind>=len(bins)-1) | np.isnan(data)] = -1
+        return ind
+
+    def update(self,reference,values):
+        ''' add a chunk of (reference, value) samples, NaN in either are ignored '''
+        reference = np.asarray(reference,dtype=float).ravel()
+        values = np.asarray(values,dtype=float).ravel()
+        if self.period is not None:
+            reference = self.bins[0]+np.mod(reference-self.bins[0],self.period)
+        nb = len(self.bins)-1
+        ind = self._index(self.bins,reference)
+        ok = (ind>=0) & ~np.isnan(values)
+        ind, ref, val = ind[ok], reference[ok], values[ok]
+        other = BinnedStats(self.bins,self.value_bins,self.period)
+        other.n = np.bincount(ind,minlength=nb).astype(float)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            other.mean = np.where(other.n>0,np.bincount(ind,weights=val,minlength=nb)/other.n,0.)
+        other.m2 = np.bincount(ind,weights=(val-other.mean[ind])**2,minlength=nb)
+        if self.value_bins is not None:
+            nv = len(self.value_bins)-1
+            vind = self._index(self.value_bins,val)
+            inside = vind>=0
+            other.hist2d = np.bincount(ind[inside]*nv+vind[inside],minlength=nb*nv).reshape(nb,nv).astype(float)
+            if self.period is not None:
+                angle = 2*np.pi*ref[inside]/self.period
+                other.cos = np.bincount(vind[inside],weights=np.cos(angle),minlength=nv)
+                other.sin = np.bincount(vind[inside],weights=np.sin(angle),minlength=nv)
+        return self.merge(other)
+
+    def merge(self,other):
+        ''' merge another accumulator (same bins) in place, returns self '''
+        n = self.n+other.n
+        with np.errstate(invalid='ignore',divide='ignore'):
+            delta = other.mean-self.mean
+            fb = np.where(n>0,other.n/n,0.)
+            self.m2 = self.m2+other.m2+delta**2*self.n*fb
+        self.mean = self.mean+delta*fb
+        self.n = n
+        if self.value_bins is not None:
+            self.hist2d = self.hist2d+other.hist2d
+            if self.period is not None:
+                self.cos = self.cos+other.cos
+                self.sin = self.sin+other.sin
+        return self
+
+    def quantiles(self,q):
+        ''' (reference bin x len(q)) quantiles of the value, linear within the value bins (needs value_bins) '''
+        q = np.atleast_1d(q)
+        cdf = np.cumsum(self.hist2d,axis=1)
+        total = cdf[:,-1:]
+        out = np.full((len(self.n),len(q)),np.nan)
+        for i in np.where(total[:,0]>0)[0]:
+            c = np.r_[0.,cdf[i]]/total[i,0]
+            out[i] = np.interp(q,c,self.value_bins)
+        return out
+
+    def result(self):
+        ''' dictionnary: count, mean, var, std per reference bin, bins, binplt, and if value_bins are set
+        hist2d (joint pdf), value_bins, pdf of the reference, and for circular references circmean and
+        resultant (mean resultant length) of the reference per value bin
+        '''
+        res = {'bins': self.bins,'binplt': 0.5*(self.bins[:-1]+self.bins[1:]),'count': self.n}
+        with np.errstate(invalid='ignore',divide='ignore'):
+            res['mean'] = np.where(self.n>0,self.mean,np.nan)
+            res['var'] = np.where(self.n>1,self.m2/(self.n-1),np.nan)
+            res['std'] = np.sqrt(res['var'])
+            res['pdf'] = self.n/(np.diff(self.bins)*self.n.sum())
+            if self.value_bins is not None:
+                res['value_bins'] = self.value_bins
+                area = np.outer(np.diff(self.bins),np.diff(self.value_bins))
+                res['hist2d'] = self.hist2d/(area*self.hist2d.sum())
+                if self.period is not None:
+                    nv = self.hist2d.sum(axis=0)
+                    res['circmean'] = np.mod(np.arctan2(self.sin,self.cos),2*np.pi)*self.period/(2*np.pi)
+                    res['resultant'] = np.hypot(self.sin,self.cos)/nv
+        return res
+
+
+def aquadopp_stats(md,years,bins=np.linspace(0,360,101),value_bins=np.linspace(0,0.5,101),chunksize=2**18):
+    ''' {year: BinnedStats} of the Aquadopp speed (HCSP) per direction (HCDT, degrees) bin and 'all' (merged years)
+    md: MooringData, each year is read chunksize samples at a time
+    '''
+    res = {'all': BinnedStats(bins,value_bins,period=360)}
+    for year in years:
+        if not md.exists('aquadopp',year) or not md.has('aquadopp',year,'HCSP',0):
+            continue
+        acc = BinnedStats(bins,value_bins,period=360)
+        nt = md.length('aquadopp',year,'HCSP')
+        for i0 in range(0,nt,chunksize):
+            acc.update(md.read('aquadopp',year,'HCDT',start=i0,stop=i0+chunksize),
+                       md.read('aquadopp',year,'HCSP',start=i0,stop=i0+chunksize))
+        res[year] = acc
+        res['all'].merge(acc)
+    return res
+
 def mypdf(u,bins):
     ''' compute a normalized pdf '''                                 
     pdf, _ = np.histogram(u,bins)
@@ -1,8 +1,6 @@
 import numpy as np
-from scipy import stats
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.cm  as cm
+# scipy.stats and matplotlib are imported in the functions that use them,
+# so importing plot_recipes (e.g. for kde_fft in a worker) stays cheap
 
 def custom_cmap(color_list):
     """
@@ -13,6 +11,7 @@ def custom_cmap(color_list):
     E.g.
         mycmap = custom_cmap(['blue', 'cyan', '#f0f0f0'])
     """
+    from matplotlib.colors import LinearSegmentedColormap
     return LinearSegmentedColormap.from_list('mycmap', color_list)
 
 def display_cmap(cmap):
@@ -27,10 +26,77 @@ def display_cmap(cmap):
         basic_cols=['blue', ... ,'red']
         my_cmap=LinearSegmentedColormap.from_list('mycmap', basic_cols)
     """
+    import matplotlib.pyplot as plt
     plt.imshow(np.linspace(0, 100, 256)[None, :],  aspect=25,    interpolation='nearest', cmap=cmap)
     plt.axis('off')
 
-def ridge_plot(data, xlabel ='', title='', bins=128, h_space=-0.5, alpha=1, figsize=(8,8), cmap='tab10'):
+def kde_scipy(series, x_values):
+    """
+        kde_scipy(series, x_values)
+
+    Reference density backend: scipy.stats.gaussian_kde of each series (NaN free) evaluated on
+    its own x_values. Cost is O(len(series) x len(x_values)) per series.
+    """
+    from scipy import stats
+    return [stats.gaussian_kde(s)(x) for s, x in zip(series, x_values)]
+
+def kde_fft(series, x_values, ngrid=4096, bw_method='scott'):
+    """
+        kde_fft(series, x_values, ngrid=4096, bw_method='scott')
+
+    Fast density backend: every series (NaN free) is linearly binned on its own grid, spanning the
+    series and 4 bandwidths on each side, and convolved with its gaussian kernel by FFT, all series in
+    one batched call, then interpolated on its x_values. Bandwidths follow gaussian_kde ('scott',
+    'silverman' or a scalar factor). ngrid is a minimum: the grids are refined so that their step is at
+    most a quarter of the bandwidth (differences to gaussian_kde of a few 1e-6 of the peak).
+    Cost is O(len(series) + ngrid log(ngrid)) per series.
+    """
+    nser = len(series)
+    n = np.array([len(s) for s in series], dtype=float)
+    std = np.array([s.std(ddof=1) if len(s) > 1 else 0. for s in series])
+    if bw_method == 'scott':
+        factor = n**(-1./5)
+    elif bw_method == 'silverman':
+        factor = (n*3/4.)**(-1./5)
+    else:
+        factor = np.full(nser, float(bw_method))
+    bw = std*factor
+    bw[bw == 0] = 1e-12
+
+    lo = np.array([s.min() for s in series]) - 4*bw
+    hi = np.array([s.max() for s in series]) + 4*bw
+    # one grid per series, step at most bw/4 (narrow distributions are not undersampled)
+    ngrid = max(ngrid, int(np.ceil(np.max(4*(hi - lo)/bw))) + 1)
+    dx = (hi - lo)/(ngrid - 1)
+
+    # linear binning of all series at once
+    counts = np.zeros(nser*ngrid)
+    for i, s in enumerate(series):
+        pos = (s - lo[i])/dx[i]
+        i0 = np.clip(np.floor(pos).astype(int), 0, ngrid-2)
+        w1 = pos - i0
+        counts += np.bincount(i*ngrid + i0, weights=1-w1, minlength=nser*ngrid)
+        counts += np.bincount(i*ngrid + i0 + 1, weights=w1, minlength=nser*ngrid)
+    counts = counts.reshape(nser, ngrid)/(n[:, None]*dx[:, None])
+
+    # gaussian convolution in Fourier space, zero-padded to avoid wrap-around
+    nfft = 2*ngrid
+    k = np.fft.rfftfreq(nfft)[None, :]/dx[:, None]
+    kernel = np.exp(-0.5*(2*np.pi*k*bw[:, None])**2)
+    dens = np.fft.irfft(np.fft.rfft(counts, nfft, axis=1)*kernel, nfft, axis=1)[:, :ngrid]
+    dens = np.maximum(dens, 0)
+    return [np.interp(x, lo[i] + dx[i]*np.arange(ngrid), d) for i, (x, d) in enumerate(zip(x_values, dens))]
+
+KDE_BACKENDS = {'fft': kde_fft, 'scipy': kde_scipy}
+
+def _kdes(data, keys, bins, kde):
+    """ NaN-free series, x values (bins points between min and max) and densities for every key """
+    series = [data[key][~np.isnan(data[key])] for key in keys]
+    x_values = [np.linspace(s.min(), s.max(), bins) for s in series]
+    backend = KDE_BACKENDS[kde] if isinstance(kde, str) else kde
+    return series, x_values, backend(series, x_values)
+
+def ridge_plot(data, xlabel ='', title='', bins=128, h_space=-0.5, alpha=1, figsize=(8,8), cmap='tab10', kde='fft'):
     """
         ridge_plot(data, xlabel, bins=128, h_space=-0.5, alpha=1, figsize=(8,6))
 
@@ -44,27 +110,23 @@ def ridge_plot(data, xlabel ='', title='', bins=128, h_space=-0.5, alpha=1, figs
     alpha : the transparency.
     figsize : the figure size.
     cmap : the colormap. Use the predefined Matplotlib colormaps.
+    kde : the density backend, 'fft' (fast, default), 'scipy' (gaussian_kde) or a callable
+          kde(series, x_values) returning the list of densities.
     """
+    import matplotlib.pyplot as plt
     nrows = len(data.keys())
     labels = list(data.keys())
     x_colors = np.linspace(0,1, nrows)
-    colors = cm.get_cmap(cmap)(x_colors)
+    colors = plt.get_cmap(cmap)(x_colors)
     fig, axes = plt.subplots(nrows,  sharex=True, figsize=figsize)
-    min_glob = 999
+    series, x_grids, kdes = _kdes(data, labels, bins, kde)
+    min_glob = min(x[0] for x in x_grids)
 
     for i, key in enumerate(data.keys()):
-        val_min = data[key][~np.isnan(data[key])].min()
-        val_max = data[key][~np.isnan(data[key])].max()
-
-        if val_min < min_glob:
-            min_glob = val_min
-
-        x_values = np.linspace(val_min, val_max, bins)
+        x_values = x_grids[i]
         c = colors[i]
-        kernel = stats.gaussian_kde(data[key][~np.isnan(data[key])])
-        kde = kernel(x_values)
-        axes[i].plot(x_values, kde, color="#f0f0f0", lw=1)
-        axes[i].fill_between(x_values, kde, color=c, alpha=alpha)
+        axes[i].plot(x_values, kdes[i], color="#f0f0f0", lw=1)
+        axes[i].fill_between(x_values, kdes[i], color=c, alpha=alpha)
         rect = axes[i].patch
         rect.set_alpha(0)
         axes[i].tick_params(left=False, labelleft=False)
@@ -92,9 +154,9 @@ def ridge_plot(data, xlabel ='', title='', bins=128, h_space=-0.5, alpha=1, figs
     plt.subplots_adjust(hspace=h_space)
     return fig, axes
 
-def waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='tab10', border=False):
+def waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='tab10', border=False, kde='fft'):
     """
-        waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='tab10', border=False)
+        waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='tab10', border=False, kde='fft')
 
     Guillaume's waterfall plot.
     data : a dictionary with a 1D series per key/set (unlimited number of keys/sets).
@@ -104,6 +166,7 @@ def waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='
     figsize : the figure size.
     cmap : is the colormap, use the predefined cmaps.
     borde : if True it plots a black line around the distributions.
+    kde : the density backend, 'fft' (fast, default), 'scipy' (gaussian_kde) or a callable.
 
     You can add the labels and title and keep editing the plot.
     E.g.
@@ -113,24 +176,23 @@ def waterfall_plot(data, bins=64, dist_height=30, alpha=1, figsize=(6,7), cmap='
         plt.title(..)
         plt.grid(..)
     """
+    import matplotlib.pyplot as plt
     nrows = len(data.keys())
     levels = np.array(list(data.keys()))
-    means = [data[i][~np.isnan(data[i])].mean() for i in data.keys()]
+    series, x_grids, kdes = _kdes(data, list(data.keys()), bins, kde)
+    means = [s.mean() for s in series]
     x_colors = np.linspace(0,1, nrows)
-    colors = cm.get_cmap(cmap)(x_colors)
+    colors = plt.get_cmap(cmap)(x_colors)
     plt.figure(figsize=figsize)
     plt.plot(means, -levels, 'ko--', label='Mean')
 
     for i, key in enumerate(levels):
         c = colors[i]
-        val_min = data[key][~np.isnan(data[key])].min()
-        val_max = data[key][~np.isnan(data[key])].max()
-        x_values = np.linspace(val_min, val_max, bins)
+        x_values = x_grids[i]
         base_line = np.zeros_like(x_values) - levels[i]
-        kernel = stats.gaussian_kde(data[key][~np.isnan(data[key])])
-        kde = kernel(x_values)*dist_height - levels[i]
-        plt.fill_between(x_values, base_line, kde, alpha=alpha, color=c)
+        kde_i = kdes[i]*dist_height - levels[i]
+        plt.fill_between(x_values, base_line, kde_i, alpha=alpha, color=c)
         if border == True:
-            plt.plot(x_values, kde, color='k', lw=1)
+            plt.plot(x_values, kde_i, color='k', lw=1)
 
     plt.legend(fontsize=12, shadow=True, loc='upper left')
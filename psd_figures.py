@@ -0,0 +1,149 @@
+''' power spectra figures (support_data/PowerSpectra -> figures/PowerSpectra)
+spectra are decimated on a log-frequency grid before plotting (the high-frequency bands hold far
+more points than a printed figure can show), each worker builds a figure template per view once and
+only swaps the line data, and (instrument, year, view) jobs are spread over a pool of headless workers
+'''
+import os
+import pickle
+from multiprocessing import Pool
+from contextlib import nullcontext
+import numpy as np
+from spectral_tools import f, M2, M4, M6, week, month, yearly
+from stratification import load_profile
+import stage_timing
+from stage_timing import stage
+
+VIEWS = ('full', 'zoom')
+INSTRUMENTS = ('rbr', 'sbe', 'density') # spectra keyed by depth (not aquadopp: 'speed', 'dir')
+
+
+def log_decimate(freq, psd, per_decade=100):
+    ''' mean psd in log-spaced frequency bins (per_decade bins per decade), bins with
+    a single point keep it as is. Returns the (geometric) mean frequency and mean psd of non-empty bins
+    '''
+    freq = np.asarray(freq)
+    psd = np.asarray(psd)
+    ok = freq > 0
+    freq, psd = freq[ok], psd[ok]
+    if len(freq) == 0:
+        return freq, psd
+    ind = np.floor(np.log10(freq)*per_decade).astype(int)
+    ind -= ind.min()
+    counts = np.bincount(ind)
+    full = counts > 0
+    logf = np.bincount(ind, weights=np.log(freq))[full]/counts[full]
+    return np.exp(logf), np.bincount(ind, weights=psd)[full]/counts[full]
+
+
+def tick_locations(stratification_file):
+    ''' upper axis ticks of both views: (locations, labels) '''
+    bvf = load_profile(stratification_file)
+    N_z_min = bvf(800, method='nearest')*3600*24 # days-1
+    N_z_max = bvf(1700, method='nearest')*3600*24 # days-1
+    return {'full': (np.array([N_z_min, N_z_max, M6, M4, M2, f, week, month, yearly]),
+                     ['$N_{max}$', '$N_{min}$', 'M6', 'M4', 'M2', 'f', 'week', 'month', 'year']),
+            'zoom': (np.array([M2, M4, M6, f, 1]), ['M2', 'M4', 'M6', 'f', 'day'])}
+
+
+class PSDFigure:
+    ''' figure template of one view: axes, typical frequencies and twin-axis labels are built once,
+    draw() only swaps the data of a pool of lines
+    '''
+    limits = {'full': ((1e-3, 1e3), (1e-11, 1e2), 'lower left'),
+              'zoom': ((0.9, 1e1), (1e-5, 1e2), 'upper right')}
+
+    def __init__(self, view, ticks):
+        import matplotlib.pyplot as plt
+        plt.rcParams.update({'font.size': 13})
+        self.view = view
+        self.fig = plt.figure(figsize=(9,4), tight_layout=True)
+        self.ax1 = self.fig.add_subplot(111)
+        self.ax2 = self.ax1.twiny()
+        self.ax1.set_xscale('log')
+        self.ax1.set_yscale('log')
+        self.ax2.set_xscale('log')
+        locations, labels = ticks[view]
+        xlim, ylim, self.legend_loc = self.limits[view]
+        for typical_freq in locations:
+            self.ax1.axvline(typical_freq, color='k', alpha=0.5, ls='--')
+        self.ax1.grid()
+        self.ax1.set_xlabel('Frequency (cpd)', fontsize=14)
+        self.ax1.set_ylabel('PSD ($\\degree C^2 / cpd$)', fontsize=14)
+        self.ax1.set_xlim(*xlim)
+        self.ax1.set_ylim(*ylim)
+        self.ax2.set_xlim(*xlim)
+        self.ax2.set_xticks(locations)
+        self.ax2.set_xticklabels(labels, fontsize=13)
+        self.ax2.minorticks_off()
+        self.lines = []
+
+    def draw(self, PowerSpectra, outfile, skip=(), per_decade=100):
+        ''' plot {depth: {'freq', 'psd'}} (sorted by depth) and save the figure '''
+        depths = [depth for depth in sorted(PowerSpectra.keys()) if depth not in skip]
+        while len(self.lines) < len(depths):
+            line, = self.ax1.plot([], [])
+            self.lines.append(line)
+        for j, line in enumerate(self.lines):
+            if j < len(depths):
+                spectrum = PowerSpectra[depths[j]]
+                line.set_data(*log_decimate(spectrum['freq'], spectrum['psd'], per_decade))
+                line.set_label(f"{depths[j]:0.0f}m")
+                line.set_visible(True)
+            else:
+                line.set_visible(False)
+                line.set_label('_hidden')
+        if self.ax1.get_legend() is not None:
+            self.ax1.get_legend().remove()
+        self.ax1.legend(handles=self.lines[:len(depths)], loc=self.legend_loc, shadow=True, ncol=3)
+        self.fig.savefig(outfile, facecolor=(1,0,0,0))
+
+
+def load_spectra(instrument, year, psd_dir):
+    ''' spectra of an instrument/year from the store (memory mapped), or the legacy pickle '''
+    from spectra_store import SpectraStore
+    PowerSpectra = SpectraStore(os.path.join(psd_dir, 'store')).load(instrument, year)
+    if not PowerSpectra: # produced by the older pickling scripts
+        with open(os.path.join(psd_dir, f'psd_{instrument}_{year}'), 'rb') as f:
+            PowerSpectra = pickle.load(f)
+    return PowerSpectra
+
+
+_templates = {}
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg') # headless
+
+
+def render_job(job, psd_dir, fig_dir, stratification_file):
+    ''' draw one (instrument, year, view) figure with the template of this process '''
+    instrument, year, view = job
+    if view not in _templates:
+        _templates[view] = PSDFigure(view, tick_locations(stratification_file))
+    with stage('read', instrument=instrument, year=year):
+        PowerSpectra = load_spectra(instrument, year, psd_dir)
+    prefix = '' if view == 'full' else f'{view}_'
+    outfile = os.path.join(fig_dir, instrument, f'{prefix}PSD_temp_{instrument}_{year}')
+    skip = (1000,) if view == 'full' else () # 1000m is bad in 2018
+    with stage('render', instrument=instrument, year=year, view=view):
+        _templates[view].draw(PowerSpectra, outfile, skip=skip)
+    return job
+
+
+def render(instruments, years, psd_dir='../../support_data/PowerSpectra', fig_dir='../../figures/PowerSpectra',
+           stratification_file='../../support_data/bvs_lucky.pkl', views=VIEWS, processes=None, pool=None):
+    ''' render every (instrument, year, view) figure on a pool of headless workers
+    (pool: an existing pool to reuse, its workers must use a non-interactive backend, e.g. MPLBACKEND=Agg)
+    '''
+    unknown = [instrument for instrument in instruments if instrument not in INSTRUMENTS]
+    if unknown:
+        raise ValueError(f'no depth-keyed spectra to plot for {unknown}, expected {INSTRUMENTS}')
+    jobs = [(instrument, str(year), view) for instrument in instruments for year in years for view in views]
+    for instrument in instruments:
+        os.makedirs(os.path.join(fig_dir, instrument), exist_ok=True)
+    args = [(job, psd_dir, fig_dir, stratification_file) for job in jobs]
+    with (Pool(processes, initializer=_init_worker) if pool is None else nullcontext(pool)) as pool:
+        for job in pool.starmap(render_job, args, chunksize=1):
+            print(*job)
+    if stage_timing.enabled and stage_timing._log is not None:
+        print(stage_timing.summary(log=stage_timing._log, run=stage_timing.run_id))
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+sys.path.append('..')
+
+# e.g. python Benchmarks.py --days 7 30 90        (run and append to the results file)
+#      python Benchmarks.py --compare             (last two commits side by side)
+
+
+def stages(block, dt):
+    ''' {name: callable} of the analysis hot paths on a (time x depth) rbr block '''
+    import obs_tools
+    import plot_recipes
+    from spectral_tools import BANDS, stitched_psd
+    windows, lims = BANDS['temperature']
+    fcut = dt/2. # 2 days lowpass, relative to the sampling frequency
+    series = [block[~np.isnan(block[:, j]), j] for j in range(block.shape[1])]
+    bins = np.linspace(np.nanmin(block), np.nanmax(block), 101)
+    return {
+        'lowfreq_filt': lambda: obs_tools.lowfreq_filt(np.nan_to_num(block), fcut, axis=0),
+        'lowfreq_filt_chunked': lambda: obs_tools.lowfreq_filt(np.nan_to_num(block), fcut, axis=0, chunksize=2**16),
+        'mystats': lambda: [obs_tools.mystats(s) for s in series],
+        'running_stats': lambda: obs_tools.RunningStats(bins).update(block).result(),
+        'myspectrum': lambda: [obs_tools.myspectrum(s, dt) for s in series],
+        'stitched_psd_per_depth': lambda: [stitched_psd(s, dt, windows, lims) for s in series],
+        'stitched_psd_block': lambda: stitched_psd(np.nan_to_num(block), dt, windows, lims),
+        'kde_fft': lambda: plot_recipes.kde_fft(series, [np.linspace(s.min(), s.max(), 128) for s in series]),
+        'kde_scipy': lambda: plot_recipes.kde_scipy([s[:20000] for s in series],
+                                                     [np.linspace(s.min(), s.max(), 128) for s in series]),
+    }
+
+
+def measure(func):
+    ''' wall time (s) and peak of the python/numpy allocations (MB) of one call '''
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func()
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return wall, peak/2**20
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(days_list, results, only=None):
+    from synthetic_data import generate
+    from mooring_data import MooringData
+    from spectra_batch import sampling_interval
+    rev = commit()
+    with tempfile.TemporaryDirectory() as netcdf_dir:
+        for days in days_list:
+            generate(netcdf_dir, years=[2015], days=days, instruments=('rbr',))
+            with MooringData(netcdf_dir) as md:
+                block = md.lazy('rbr', 2015, 'TEMP')[:, :]
+            for name, func in stages(block, sampling_interval('rbr', 2015)).items():
+                if only and name not in only:
+                    continue
+                wall, peak = measure(func)
+                record = {'commit': rev, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stage': name, 'days': days,
+                          'shape': list(block.shape), 'wall_s': round(wall, 4), 'peak_mb': round(peak, 2)}
+                print(f"{name:24s} {days:5d} days {wall:9.3f} s {peak:10.1f} MB")
+                with open(results, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+
+def compare(results):
+    ''' wall time and peak memory of the last two benchmarked commits '''
+    with open(results, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    commits = list(dict.fromkeys(r['commit'] for r in records))[-2:]
+    last = {c: {(r['stage'], r['days']): r for r in records if r['commit'] == c} for c in commits}
+    print(f"{'stage':24s} {'days':>5s} " + ' '.join(f'{c:>22s}' for c in commits))
+    for key in sorted(set().union(*[set(v) for v in last.values()])):
+        cells = [f"{last[c][key]['wall_s']:9.3f}s {last[c][key]['peak_mb']:9.1f}MB" if key in last[c] else ' '*22
+                 for c in commits]
+        print(f'{key[0]:24s} {key[1]:5d} ' + ' '.join(cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the analysis hot paths on synthetic rbr data')
+    parser.add_argument('--days', nargs='+', type=int, default=[7, 30])
+    parser.add_argument('--stages', nargs='+', default=None)
+    parser.add_argument('--results', default='../../support_data/benchmarks.jsonl')
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.results)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        run(args.days, args.results, args.stages)
@@ -0,0 +1,29 @@
+import argparse
+import os
+import sys
+import numpy as np
+sys.path.append('..')
+from mooring_data import MooringData
+from spectra_batch import band_parameters
+from spectral_tools import stitched_csd, coherence_phase
+
+# e.g. python CoherenceMatrix.py rbr --years 2015 2016
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Coherence and phase between every pair of depths (depth x depth x freq)')
+    parser.add_argument('instrument', choices=['rbr', 'sbe'])
+    parser.add_argument('--years', nargs='+', required=True)
+    parser.add_argument('--netcdf', default='../../netcdf')
+    parser.add_argument('--out', default='../../support_data/coherence')
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    with MooringData(args.netcdf) as md:
+        for year in args.years:
+            if not md.exists(args.instrument, year):
+                continue
+            block = md.lazy(args.instrument, year, 'TEMP')
+            order = np.argsort(block.depths)
+            freq, csd, nseg, power = stitched_csd(block[:, order], *band_parameters(args.instrument, year))
+            coh, phase = coherence_phase(csd, power)
+            np.savez(os.path.join(args.out, f'coherence_{args.instrument}_{year}.npz'), depths=block.depths[order],
+                     freq=freq, coherence=coh.astype('float32'), phase=phase.astype('float32'), nseg=nseg)
+            print(year, coh.shape)
@@ -0,0 +1,26 @@
+import argparse
+import sys
+import numpy as np
+sys.path.append('..')
+from mooring_data import MooringData
+from mixing_events import detect
+
+# e.g. python MixingEvents.py --years 2011 2012 2014 2015 2016 2017 2018 2019 --threshold 0
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index of mixing events (dT/dz below a threshold) on the rbr chain')
+    parser.add_argument('--years', nargs='+', required=True)
+    parser.add_argument('--threshold', type=float, default=0., help='degC/m, z upward')
+    parser.add_argument('--min-samples', type=int, default=1)
+    parser.add_argument('--netcdf', default='../../netcdf')
+    parser.add_argument('--out', default='../../support_data/mixing_events.npy')
+    parser.add_argument('--check', action='store_true', help='detect again with another chunk size, the events must be identical')
+    args = parser.parse_args()
+    with MooringData(args.netcdf) as md:
+        events = detect(md, 'rbr', args.years, threshold=args.threshold, min_samples=args.min_samples)
+        if args.check:
+            other = detect(md, 'rbr', args.years, threshold=args.threshold, min_samples=args.min_samples, chunksize=1000)
+            if not np.array_equal(events.events, other.events):
+                sys.exit('events depend on the chunk size')
+            print('same events with chunks of 2**16 and 1000 samples')
+    events.save(args.out)
+    print(f'{len(events)} events in {args.out}')
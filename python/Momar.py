@@ -0,0 +1,154 @@
+import argparse
+import os
+import sys
+sys.path.append('..')
+
+# single entry point of the pipeline, heavy modules (netCDF4, scipy, gsw, matplotlib) are only
+# imported by the subcommand that needs them, and psd/plot share one pool forked once
+# e.g. python Momar.py ingest rbr --years 2011 2012 2014
+#      python Momar.py density --years 2015 2016
+#      python Momar.py psd rbr sbe --years 2015 2016 -j 8 --regrid 20 --plot
+#      python Momar.py plot rbr --years 2015 2016
+#      python Momar.py stats aquadopp --years 2015 2016 2017
+
+_pool = None
+
+def worker_pool(processes=None):
+    ''' pool of the invocation, forked on first use after the imports of the subcommand so the workers inherit them '''
+    global _pool
+    if _pool is None:
+        from multiprocessing import Pool
+        os.environ.setdefault('MPLBACKEND', 'Agg') # headless workers for the figures
+        _pool = Pool(processes)
+    return _pool
+
+
+def ingest(args):
+    from mooring_archive import ingest
+    for instrument in args.instruments:
+        ingest(instrument, args.years, args.netcdf, args.archive, compress=args.compress)
+
+
+def density(args):
+    import numpy as np
+    from mooring_data import MooringData
+    from seawater import sbe_density
+    os.makedirs(args.out, exist_ok=True)
+    with MooringData(args.netcdf) as md:
+        for year in args.years:
+            if not md.exists('sbe', year):
+                print(year, 'no sbe file')
+                continue
+            depths, rho, missing = sbe_density(md, year)
+            time = md.block_time('sbe', year) # rho is padded to the longest level, so is its time base
+            if time is None or len(time) != len(rho):
+                print(year, 'no sbe TIME as long as the density record')
+                continue
+            np.savez(os.path.join(args.out, f'density_{year}.npz'), depths=depths, rho=rho, time=time)
+            for depth, variables in missing.items():
+                print(year, depth, 'missing', *variables)
+
+
+def psd(args):
+    from spectra_batch import run_batch, regrid_store
+    if args.plot:
+        import psd_figures # imported before forking, the workers inherit it
+    pool = worker_pool(args.processes)
+    failed = run_batch(args.instruments, args.years, args.netcdf, args.out, pool=pool)
+    if args.regrid:
+        regrid_store(args.out, args.instruments, args.years, per_decade=args.regrid)
+    if args.plot:
+        plotted = [instrument for instrument in args.instruments if instrument in psd_figures.INSTRUMENTS]
+        skipped = [instrument for instrument in args.instruments if instrument not in psd_figures.INSTRUMENTS]
+        if skipped:
+            print('no figures for', *skipped)
+        if plotted:
+            psd_figures.render(plotted, args.years, args.out, args.fig, args.stratification, pool=pool)
+    if failed:
+        print(f'{len(failed)} jobs failed, run again to retry them')
+        return 1
+
+
+def plot(args):
+    from psd_figures import render
+    render(args.instruments, args.years, args.psd, args.fig, args.stratification, views=args.views,
+           pool=worker_pool(args.processes))
+
+
+def stats(args):
+    import numpy as np
+    from mooring_data import MooringData
+    from obs_tools import RunningStats, aquadopp_stats
+    os.makedirs(args.out, exist_ok=True)
+    with MooringData(args.netcdf) as md:
+        if args.instrument == 'aquadopp':
+            for year, acc in aquadopp_stats(md, args.years).items():
+                np.savez(os.path.join(args.out, f'stats_aquadopp_{year}.npz'), **acc.result())
+            return
+        for year in args.years:
+            if not md.exists(args.instrument, year):
+                continue
+            block = md.lazy(args.instrument, year, 'TEMP')
+            acc = RunningStats(np.linspace(*args.bins))
+            for i0 in range(0, len(block), args.chunksize):
+                acc.update(block[i0:i0+args.chunksize], axis=0)
+            np.savez(os.path.join(args.out, f'stats_{args.instrument}_{year}.npz'), depths=block.depths, **acc.result())
+            print(year, len(block.depths), 'levels')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MOMAR mooring analysis pipeline')
+    sub = parser.add_subparsers(dest='command', required=True)
+    netcdf = argparse.ArgumentParser(add_help=False)
+    netcdf.add_argument('--netcdf', default='../../netcdf')
+    netcdf.add_argument('--years', nargs='+', required=True)
+    workers = argparse.ArgumentParser(add_help=False)
+    workers.add_argument('-j', '--processes', type=int, default=None, help='number of workers (default: number of cores)')
+    figures = argparse.ArgumentParser(add_help=False)
+    figures.add_argument('--fig', default='../../figures/PowerSpectra')
+    figures.add_argument('--stratification', default='../../support_data/bvs_lucky.pkl')
+
+    p = sub.add_parser('ingest', parents=[netcdf], help='per-year netcdf files -> chunked archive')
+    p.add_argument('instruments', nargs='+', choices=['rbr', 'sbe', 'aquadopp'])
+    p.add_argument('--archive', default='../../archive')
+    p.add_argument('--compress', action='store_true')
+    p.set_defaults(func=ingest)
+
+    p = sub.add_parser('density', parents=[netcdf], help='sbe density (TEOS-10) of every level')
+    p.add_argument('--out', default='../../support_data/density')
+    p.set_defaults(func=density)
+
+    p = sub.add_parser('psd', parents=[netcdf, workers, figures], help='stitched power spectra (resumable)')
+    p.add_argument('instruments', nargs='+', choices=['rbr', 'sbe', 'density', 'aquadopp'])
+    p.add_argument('--out', default='../../support_data/PowerSpectra')
+    p.add_argument('--regrid', type=int, default=None, metavar='PER_DECADE')
+    p.add_argument('--plot', action='store_true', help='also render the figures on the same workers')
+    p.set_defaults(func=psd)
+
+    p = sub.add_parser('plot', parents=[workers, figures], help='power spectra figures')
+    p.add_argument('instruments', nargs='+', choices=['rbr', 'sbe', 'density']) # psd_figures.INSTRUMENTS
+    p.add_argument('--years', nargs='+', required=True)
+    p.add_argument('--psd', default='../../support_data/PowerSpectra')
+    p.add_argument('--views', nargs='+', default=['full', 'zoom'], choices=['full', 'zoom'])
+    p.set_defaults(func=plot)
+
+    p = sub.add_parser('stats', parents=[netcdf], help='single-pass statistics per level (aquadopp: per direction bin)')
+    p.add_argument('instrument', choices=['rbr', 'sbe', 'aquadopp'])
+    p.add_argument('--out', default='../../support_data/stats')
+    p.add_argument('--bins', nargs=3, type=float, default=[2, 14, 101], metavar=('MIN', 'MAX', 'N'))
+    p.add_argument('--chunksize', type=int, default=2**18)
+    p.set_defaults(func=stats)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'bins', None) is not None:
+        args.bins[2] = int(args.bins[2])
+    try:
+        return args.func(args)
+    finally:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import sys
+sys.path.append('..')
+from mooring_archive import ingest
+
+# e.g. python MooringIngest.py rbr 2011 2012 2013 2014 2015 2016 2017 2018 2019
+instrument = sys.argv[1] # 'rbr', 'sbe', 'aquadopp'
+years = list(sys.argv[2:])
+
+ingest(instrument, years, '../../netcdf', '../../archive')
@@ -0,0 +1,22 @@
+import argparse
+import sys
+sys.path.append('..')
+from spectra_batch import INSTRUMENTS, run_batch, regrid_store
+
+# e.g. python PowerSpectraBatch.py rbr sbe density aquadopp --years 2011 2012 2014 -j 8
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Power spectra for every instrument/year/depth on a process pool')
+    parser.add_argument('instruments', nargs='+', choices=INSTRUMENTS)
+    parser.add_argument('--years', nargs='+', required=True)
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of workers (default: number of cores)')
+    parser.add_argument('--netcdf', default='../../netcdf')
+    parser.add_argument('--out', default='../../support_data/PowerSpectra')
+    parser.add_argument('--regrid', type=int, default=None, metavar='PER_DECADE',
+                        help='also write log_spectra.npz, every spectrum on a shared log grid')
+    args = parser.parse_args()
+    failed = run_batch(args.instruments, args.years, args.netcdf, args.out, processes=args.processes)
+    if args.regrid:
+        regrid_store(args.out, args.instruments, args.years, per_decade=args.regrid)
+    if failed:
+        print(f'{len(failed)} jobs failed, run again to retry them')
+        sys.exit(1)
@@ -1,17 +1,16 @@
 from netCDF4 import Dataset
 import numpy as np
-import scipy.signal as sg
 import pickle
 import sys
+sys.path.append('..')
+from spectral_tools import BANDS, stitched_psd_dict
 
 instrument = sys.argv[1] # 'rbr', 'sbe'
 years = list(sys.argv[2:])
 
 for year in years:
-    print(type(year))
     print(instrument, year)
     Data = {}
-    PowerSpectra = {}
 
     if instrument == 'rbr':
         dt = 15/(3600*24)
@@ -41,34 +40,9 @@ for year in years:
                 except:
                     print(f'{year} - {d_i} has no TEMP')
 
-    for depth in Data.keys():
-        print(0)
-        temp = Data[depth]
-        freq_aux = np.array([])
-        psd_aux = np.array([])
+    windows, lims = BANDS['temperature'] # windows in days, limit frequencies in cpd
+    PowerSpectra = stitched_psd_dict(Data, dt, windows, lims)
 
-        windows = np.array([49, 35, 10, 2, 0.5])/dt # the size of the windows in days/dt
-        lims = [0.08, 1, 3, 10, 20] # limit frequency for windows
-
-        freq, psd = sg.periodogram(temp, fs=1./dt)
-        ind, = np.where(freq < lims[0])
-        freq_aux = np.concatenate((freq_aux, freq[ind]))
-        psd_aux = np.concatenate((psd_aux, psd[ind]))
-
-        for i in range(0,len(lims)-1):
-            freq, psd = sg.welch(temp, fs=1./dt, window='hanning', nperseg=windows[i], noverlap=0.15)
-            ind, = np.where(((freq >= lims[i]) & (freq < lims[i+1])))
-            freq_aux = np.concatenate((freq_aux, freq[ind]))
-            psd_aux = np.concatenate((psd_aux, psd[ind]))
-            print(1)
-
-        freq, psd = sg.welch(temp, fs=1./dt, window='hanning', nperseg=windows[-1], noverlap=0.15)
-        ind, = np.where(freq >= lims[-1])
-        freq_aux = np.concatenate((freq_aux, freq[ind]))
-        psd_aux = np.concatenate((psd_aux, psd[ind]))
-
-        PowerSpectra[depth] = {'freq': freq_aux, 'psd': psd_aux}
-
-outfile = open(f'../../support_data/PowerSpectra/psd_{instrument}_{year}','wb')
-pickle.dump(PowerSpectra, outfile)
-outfile.close()
+    outfile = open(f'../../support_data/PowerSpectra/psd_{instrument}_{year}','wb')
+    pickle.dump(PowerSpectra, outfile)
+    outfile.close()
@@ -1,19 +1,16 @@
-from netCDF4 import Dataset
-import numpy as np
-import scipy.signal as sg
 import pickle
 import sys
-import gsw
+sys.path.append('..')
+from spectral_tools import BANDS, stitched_psd, stitched_psd_dict
+from mooring_data import MooringData
+from seawater import sbe_density
 
 # instrument = sys.argv[1] # 'rbr', 'sbe'
 years = list(sys.argv[1:])
-lat = 37 + .17/.6
-lon = 32 + .16/.4
+md = MooringData('../../netcdf')
 
 for year in years:
     print(year)
-    Data = {}
-    PowerSpectra = {}
 
     if year == '2011':
         dt = 180/(3600*24) # 2011 has a period of 180s
@@ -21,51 +18,24 @@ for year in years:
     else:
         dt = 360/(3600*24)
 
-    with Dataset(f'../../netcdf/{year}/sbe.nc', 'r') as nc:
-
-        depth_y = list(nc['DEPTH'][:])
-        #print(depth_y)
-
-        for d_i in depth_y:
-
-            try:
-                temp_aux = np.array(nc[str(d_i)]['TEMP'][:])
-                prac_sal = np.array(nc[str(d_i)]['PSAL'][:])
-                pres_aux = np.array(nc[str(d_i)]['PRES'][:])
-                abs_sal = gsw.SA_from_SP(prac_sal, pres_aux, lon, lat)
-                Data[d_i] = gsw.density.rho_t_exact(abs_sal, temp_aux, pres_aux)
-
-            except:
-                print(f'Not able to compute density for {year} - {d_i}.')
-
-    for depth in Data.keys():
-        # computing density
-        density = Data[depth]
-
-        # Power spectra analysis
-        freq_aux = np.array([])
-        psd_aux = np.array([])
-
-        windows = np.array([49, 35, 10, 2, 0.5])/dt # the size of the windows in days/dt
-        lims = [0.08, 1, 3, 10, 20] # limit frequency for windows
-
-        freq, psd = sg.periodogram(density, fs=1./dt)
-        ind, = np.where(freq < lims[0])
-        freq_aux = np.concatenate((freq_aux, freq[ind]))
-        psd_aux = np.concatenate((psd_aux, psd[ind]))
-
-        for i in range(0,len(lims)-1):
-            freq, psd = sg.welch(density, fs=1./dt, window='hanning', nperseg=windows[i], noverlap=0.15)
-            ind, = np.where(((freq >= lims[i]) & (freq < lims[i+1])))
-            freq_aux = np.concatenate((freq_aux, freq[ind]))
-            psd_aux = np.concatenate((psd_aux, psd[ind]))
-
-        freq, psd = sg.welch(density, fs=1./dt, window='hanning', nperseg=windows[-1], noverlap=0.15)
-        ind, = np.where(freq >= lims[-1])
-        freq_aux = np.concatenate((freq_aux, freq[ind]))
-        psd_aux = np.concatenate((psd_aux, psd[ind]))
-
-        PowerSpectra[depth] = {'freq': freq_aux, 'psd': psd_aux}
+    depths, rho, missing = sbe_density(md, year)
+    for d_i, variables in missing.items():
+        print(f'Not able to compute density for {year} - {d_i}: no {", ".join(variables)}.')
+
+    # record length of each complete level: density needs TEMP, PSAL and PRES (the block is padded with NaN)
+    levels = [j for j, d_i in enumerate(depths) if d_i not in missing]
+    lengths = [min(md.length('sbe', year, var, j) for var in ['TEMP', 'PSAL', 'PRES']) for j in levels]
+
+    # Power spectra analysis
+    windows, lims = BANDS['temperature'] # windows in days, limit frequencies in cpd
+    if lengths and len(set(lengths)) == 1:
+        # one record length: the block goes to stitched_psd as is (a view if no level is missing)
+        block = rho[:lengths[0]] if len(levels) == len(depths) else rho[:lengths[0], levels]
+        freq, psd = stitched_psd(block, dt, windows, lims, axis=0)
+        PowerSpectra = {depths[j]: {'freq': freq, 'psd': psd[:, i]} for i, j in enumerate(levels)}
+    else:
+        Data = {depths[j]: rho[:n, j] for j, n in zip(levels, lengths)}
+        PowerSpectra = stitched_psd_dict(Data, dt, windows, lims)
 
     outfile = open(f'../../support_data/PowerSpectra/psd_density_{year}','wb')
     pickle.dump(PowerSpectra, outfile)
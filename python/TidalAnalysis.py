@@ -0,0 +1,24 @@
+import argparse
+import os
+import sys
+import numpy as np
+sys.path.append('..')
+from mooring_data import MooringData
+from tidal_tools import tidal_analysis
+
+# e.g. python TidalAnalysis.py rbr --years 2011 2012 2014 2015 --window 30 --step 15
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='M2, S2, M4, M6 and f amplitudes/phases versus depth and time')
+    parser.add_argument('instrument', choices=['rbr', 'sbe'])
+    parser.add_argument('--years', nargs='+', required=True)
+    parser.add_argument('--window', type=float, default=30., help='days')
+    parser.add_argument('--step', type=float, default=None, help='days (default: window/2)')
+    parser.add_argument('--netcdf', default='../../netcdf')
+    parser.add_argument('--out', default='../../support_data/tides')
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    with MooringData(args.netcdf) as md:
+        results = tidal_analysis(md, args.instrument, args.years, window=args.window, step=args.step)
+    for year, res in results.items():
+        np.savez(os.path.join(args.out, f'tides_{args.instrument}_{year}.npz'), **res)
+        print(year, res['amplitude'].shape)
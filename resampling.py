@@ -0,0 +1,117 @@
+''' instruments and years on a common time base
+the sampling interval is read from the TIME of each file (not from per-script year ladders), channels are
+resampled with polyphase anti-aliased filters (scipy.signal.resample_poly) onto a grid of multiples of
+the requested dt (days since 1950-01-01), so series of different instruments line up sample by sample.
+NaN gaps are filled for filtering and then masked again wherever the filter reaches them.
+Resampled channels are cached on disk (.npz), keyed by the source file, so the 15 s rbr series are
+decimated once and not at every session
+
+E.g.
+    rs = Resampler(MooringData('../netcdf'), cache_dir='../support_data/resampled')
+    time, data = rs.common([('rbr', 2015, 'TEMP', 1000), ('sbe', 2015, 'TEMP', 1000)], dt=1/24.)
+'''
+import os
+import json
+import hashlib
+from fractions import Fraction
+import numpy as np
+from stage_timing import stage
+
+
+def resample_ratio(dt_in, dt_out, max_denominator=1000):
+    ''' (up, down) integers with dt_in/dt_out = up/down, intervals rounded to the second '''
+    ratio = Fraction(int(round(dt_in*86400)), int(round(dt_out*86400))).limit_denominator(max_denominator)
+    return ratio.numerator, ratio.denominator
+
+
+def resample(data, dt_in, dt_out, axis=0, tol=1e-3):
+    ''' polyphase resampling of data (time along axis) from dt_in to dt_out (days)
+    NaN are linearly interpolated before filtering, outputs whose filter footprint overlaps a gap
+    (resampled validity below 1-tol) are set to NaN. Output sample k is at time k*dt_out from the first input sample
+    '''
+    from scipy.signal import resample_poly
+    data = np.moveaxis(np.asarray(data, dtype=float), axis, 0)
+    up, down = resample_ratio(dt_in, dt_out)
+    valid = ~np.isnan(data)
+    filled = data.copy()
+    if not valid.all():
+        t = np.arange(len(data))
+        for col in zip(*np.where(~valid.all(axis=0))) if data.ndim > 1 else [()]:
+            v = valid[(slice(None),) + col]
+            filled[(slice(None),) + col] = np.interp(t, t[v], data[(slice(None),) + col][v]) if v.any() else 0.
+    # filter around the mean, so the zero padding of resample_poly does not pull the edges
+    mean = filled.mean(axis=0) if len(filled) else 0.
+    out = resample_poly(filled - mean, up, down, axis=0) + mean
+    if not valid.all():
+        # resampled gap indicator, i.e. validity padded with ones: the record edges are not gaps
+        gaps = resample_poly((~valid).astype(float), up, down, axis=0)
+        out[gaps > tol] = np.nan
+    return np.moveaxis(out, 0, axis)
+
+
+def to_grid(time, data, dt, t0=None, t1=None):
+    ''' series already sampled at dt onto the grid of multiples of dt (days since 1950) in [t0, t1], linear
+    interpolation of the sub-sample shift, NaN outside the record. Returns grid, data
+    '''
+    t0 = time[0] if t0 is None else t0
+    t1 = time[-1] if t1 is None else t1
+    grid = np.arange(np.ceil(t0/dt - 1e-9), np.floor(t1/dt + 1e-9) + 1)*dt
+    return grid, np.interp(grid, time, data, left=np.nan, right=np.nan)
+
+
+class Resampler:
+    ''' channels of a MooringData resampled on grids of multiples of dt, cached in cache_dir '''
+    def __init__(self, md, cache_dir='../support_data/resampled'):
+        self.md = md
+        self.cache_dir = cache_dir
+
+    def _cache_path(self, instrument, year, var, level, dt):
+        path = self.md.path(instrument, year)
+        st = os.stat(path)
+        key = json.dumps([os.path.abspath(path), st.st_size, int(st.st_mtime), var, int(level), round(dt*86400, 3)])
+        return os.path.join(self.cache_dir, f'{instrument}_{year}_{var}_{level}_'
+                            + hashlib.sha1(key.encode()).hexdigest()[:16] + '.npz')
+
+    def channel(self, instrument, year, var='TEMP', depth=None, level=None, tolerance=None, dt=1/24., refresh=False):
+        ''' (grid, data) of one channel resampled at dt (days), None if it does not exist '''
+        if level is None:
+            level = 0 if depth is None else self.md.nearest_level(instrument, year, depth, tolerance)
+            if level is None:
+                return None
+        if not self.md.exists(instrument, year) or not self.md.has(instrument, year, var, level):
+            return None
+        path = self._cache_path(instrument, year, var, level, dt)
+        if os.path.exists(path) and not refresh:
+            with np.load(path) as f:
+                return f['time'], f['data']
+        with stage('read', instrument=instrument, year=year, depth=depth if depth is not None else level):
+            data = self.md.read(instrument, year, var, level=level)
+            time = self.md.time(instrument, year, level=level)
+        dt_in = self.md.sampling_interval(instrument, year, level=level)
+        with stage('resample', instrument=instrument, year=year, depth=depth if depth is not None else level):
+            out = resample(data, dt_in, dt)
+            grid, out = to_grid(time[0] + np.arange(len(out))*dt, out, dt)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, time=grid, data=out)
+        os.replace(tmp, path)
+        return grid, out
+
+    def common(self, channels, dt=1/24., tolerance=None):
+        ''' channels [(instrument, year, var, depth), ...] on their common period: grid, (time x channel) data
+        channels that do not exist are all NaN
+        '''
+        series = [self.channel(instrument, year, var, depth=depth, tolerance=tolerance, dt=dt)
+                  for instrument, year, var, depth in channels]
+        found = [s for s in series if s is not None and len(s[0])]
+        if not found:
+            return np.array([]), np.empty((0, len(channels)))
+        t0 = max(s[0][0] for s in found)
+        t1 = min(s[0][-1] for s in found)
+        grid = np.arange(np.round(t0/dt), np.round(t1/dt) + 1)*dt
+        out = np.full((len(grid), len(channels)), np.nan)
+        for j, s in enumerate(series):
+            if s is not None and len(s[0]):
+                i0 = int(np.round(t0/dt - s[0][0]/dt))
+                out[:, j] = s[1][i0:i0 + len(grid)]
+        return grid, out
@@ -0,0 +1,65 @@
+''' seawater properties (TEOS-10, gsw) of whole mooring blocks
+absolute salinity and in-situ density are computed for (time x depth) arrays by chunks of time,
+into a preallocated output, instead of one level at a time
+'''
+import numpy as np
+import gsw
+from stage_timing import timed
+
+# Lucky Strike mooring
+lat = 37 + .17/.6
+lon = 32 + .16/.4
+
+
+@timed('density')
+def density_block(temp, psal, pres, chunksize=2**16, dtype=float, out=None, return_sa=False):
+    ''' in-situ density (kg/m3) of (time x depth) blocks of temperature, practical salinity and pressure
+
+    Parameters:
+    -----------
+    :param 1-3: temp (degC), psal (PSU), pres (dbar): same shape, time along the first axis, any
+                array-like sliceable by time (ndarray, netCDF variable, MooringData LazyBlock)
+    :param 4: chunksize (optional, default=65536): time samples computed at once (bounds memory)
+    :param 5: dtype (optional, default=float): output type, e.g. np.float32 to halve the memory
+    :param 6: out (optional): preallocated output array, e.g. a np.memmap
+    :param 7: return_sa (optional, default=False): also return the absolute salinity
+
+    Returned:
+    ---------
+    :return: rho (and SA if return_sa), same shape as temp, NaN where an input is NaN
+    '''
+    shape = temp.shape
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    sa_out = np.empty(shape, dtype=dtype) if return_sa else None
+    for i0 in range(0, shape[0], chunksize):
+        sl = slice(i0, min(i0 + chunksize, shape[0]))
+        p = np.asarray(pres[sl], dtype=float)
+        sa = gsw.SA_from_SP(np.asarray(psal[sl], dtype=float), p, lon, lat)
+        out[sl] = gsw.density.rho_t_exact(sa, np.asarray(temp[sl], dtype=float), p)
+        if return_sa:
+            sa_out[sl] = sa
+    return (out, sa_out) if return_sa else out
+
+
+def sbe_density(md, year, chunksize=2**16, dtype=float, return_sa=False):
+    ''' density of every level of an sbe.nc file (MooringData md)
+
+    Returned:
+    ---------
+    :return: depths, rho (time x depth, NaN columns for incomplete levels), missing {depth: [variables]}
+             (plus SA after rho if return_sa)
+    '''
+    depths = md.depths('sbe', year)
+    missing = {}
+    for level, depth in enumerate(depths):
+        absent = [var for var in ['TEMP', 'PSAL', 'PRES'] if not md.has('sbe', year, var, level)]
+        if absent:
+            missing[depth] = absent
+    nt = max([md.length('sbe', year, var, level) for var in ['TEMP', 'PSAL', 'PRES']
+              for level in range(len(depths))], default=0)
+    blocks = [md.lazy('sbe', year, var, length=nt) for var in ['TEMP', 'PSAL', 'PRES']]
+    res = density_block(*blocks, chunksize=chunksize, dtype=dtype, return_sa=return_sa)
+    if return_sa:
+        return depths, res[0], missing, res[1]
+    return depths, res, missing
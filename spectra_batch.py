@@ -0,0 +1,228 @@
+''' parallel and resumable generation of the power spectra in support_data/PowerSpectra/store
+every (instrument, year, depth) is an independent job run on a process pool,
+finished jobs are recorded in a json manifest so an interrupted run restarts where it stopped
+'''
+import os
+import json
+from functools import partial
+from contextlib import nullcontext
+from multiprocessing import Pool
+import numpy as np
+from spectral_tools import BANDS, stitched_psd, stitched_dof, log_frequencies, log_regrid
+from spectra_store import SpectraStore
+from mooring_data import MooringData
+import stage_timing
+from stage_timing import stage
+
+INSTRUMENTS = ('rbr', 'sbe', 'density', 'aquadopp')
+
+
+def sampling_interval(instrument, year):
+    ''' sampling interval (days) of an instrument for a given deployment year '''
+    year = str(year)
+    if instrument == 'rbr':
+        return 15/(3600*24)
+    elif instrument in ['sbe', 'density']:
+        if year == '2011':
+            return 180/(3600*24) # 2011 has a period of 180s
+        return 360/(3600*24)
+    elif instrument == 'aquadopp':
+        if year in ['2011']:
+            return 180/(3600*24)
+        elif year in ['2012']:
+            return 6/(60*24)
+        elif year in ['2016', '2017']:
+            return 10/(60*24) # 10 min
+        return 12/(60*24) # 2014, 2015, 2018, 2019
+    raise ValueError(f'unknown instrument {instrument}')
+
+
+_mooring = {}
+
+def mooring_data(netcdf_dir):
+    ''' one MooringData per process and netcdf tree, so workers keep their files open between jobs '''
+    if netcdf_dir not in _mooring:
+        _mooring[netcdf_dir] = MooringData(netcdf_dir)
+    return _mooring[netcdf_dir]
+
+
+def close_mooring_data():
+    ''' close the files opened by this process, before forking workers (HDF5 handles must not cross a fork) '''
+    for md in _mooring.values():
+        md.close()
+    _mooring.clear()
+
+
+def netcdf_file(instrument, year, netcdf_dir):
+    return mooring_data(netcdf_dir).path('sbe' if instrument == 'density' else instrument, year)
+
+
+def list_channels(instrument, year, netcdf_dir):
+    ''' keys of the channels (depths, or variables for aquadopp) of one instrument/year '''
+    if instrument == 'aquadopp':
+        return ['speed', 'dir']
+    return [float(d) for d in mooring_data(netcdf_dir).depths('sbe' if instrument == 'density' else instrument, year)]
+
+
+def load_channel(instrument, year, key, netcdf_dir):
+    ''' 1D series of one channel without its NaN (as for the rbr in the pickling scripts), None if the level has no data '''
+    md = mooring_data(netcdf_dir)
+    if instrument == 'aquadopp':
+        if key == 'speed':
+            aux_array = md.read('aquadopp', year, 'HCSP')
+        else:
+            aux_array = md.read('aquadopp', year, 'HCDT')*np.pi/180 # change to radians
+    elif instrument == 'rbr':
+        aux_array = md.read('rbr', year, 'TEMP', depth=key, tolerance=0)
+    else:
+        level = md.nearest_level('sbe', year, key, tolerance=0)
+        if instrument == 'sbe':
+            aux_array = md.read('sbe', year, 'TEMP', level=level)
+        else:
+            temp_aux, prac_sal, pres_aux = [md.read('sbe', year, var, level=level) for var in ['TEMP', 'PSAL', 'PRES']]
+            if temp_aux is None or prac_sal is None or pres_aux is None:
+                return None
+            from seawater import density_block # gsw is only needed for density
+            aux_array = density_block(temp_aux, prac_sal, pres_aux)
+    if aux_array is None:
+        return None
+    return aux_array[~np.isnan(aux_array)]
+
+
+def expand_jobs(instruments, years, netcdf_dir):
+    ''' list of (instrument, year, key) jobs, years without a netcdf file are skipped '''
+    jobs = []
+    for instrument in instruments:
+        for year in years:
+            if not os.path.exists(netcdf_file(instrument, year, netcdf_dir)):
+                print(f'{instrument} {year}: no netcdf file, skipped')
+                continue
+            jobs += [(instrument, str(year), key) for key in list_channels(instrument, year, netcdf_dir)]
+    return jobs
+
+
+def job_name(job):
+    instrument, year, key = job[:3]
+    return f'{instrument}_{year}_{key}'
+
+
+def band_parameters(instrument, year):
+    ''' dt (days), windows (days) and lims (cpd) of the stitched psd of an instrument/year '''
+    windows, lims = BANDS['aquadopp' if instrument == 'aquadopp' else 'temperature']
+    return sampling_interval(instrument, year), windows, lims
+
+
+class Manifest:
+    ''' json record of the finished jobs: {job_name: {'hash': entry hash, 'status': 'done' or 'missing'}}
+    a job is finished only for the entry hash it was run with, i.e. same input file and parameters
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.jobs = json.load(f)
+
+    def finished(self, job):
+        return self.jobs.get(job_name(job), {}).get('hash') == job[3]
+
+    def record(self, job, status):
+        self.jobs[job_name(job)] = {'hash': job[3], 'status': status}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(tmp, self.path) # atomic, a crash never leaves a broken manifest
+
+
+def run_job(job, netcdf_dir, store_dir):
+    ''' compute the stitched psd of one channel and put it in the store, returns (job, status) '''
+    instrument, year, key, h = job
+    store = SpectraStore(store_dir)
+    if store.has(h):
+        return job, 'done'
+    try:
+        with stage('read', instrument=instrument, year=year, depth=key):
+            data = load_channel(instrument, year, key, netcdf_dir)
+        if data is None or len(data) == 0:
+            return job, 'missing'
+        dt, windows, lims = band_parameters(instrument, year)
+        with stage('spectral', instrument=instrument, year=year, depth=key):
+            freq, psd = stitched_psd(data, dt, windows, lims)
+        if np.isnan(psd).all():
+            return job, 'failed: all-NaN spectrum'
+        with stage('store', instrument=instrument, year=year, depth=key):
+            store.put(h, freq, psd, meta={'instrument': instrument, 'year': year, 'key': key, 'dt': dt, 'nt': len(data),
+                                          'windows': list(map(float, windows)), 'lims': list(map(float, lims))})
+        return job, 'done'
+    except Exception as err:
+        return job, f'failed: {err}'
+
+
+def run_batch(instruments, years, netcdf_dir, out_dir, processes=None, pool=None):
+    ''' run every pending job on a pool of processes (default: one per core)
+
+    spectra go to the SpectraStore in out_dir/store, the manifest lives in out_dir/manifest.json.
+    Jobs whose input file and parameters did not change since the last run are skipped.
+    pool: an existing pool to reuse (processes is then ignored).
+    returns the list of jobs that failed
+    '''
+    store_dir = os.path.join(out_dir, 'store')
+    store = SpectraStore(store_dir)
+    manifest = Manifest(os.path.join(out_dir, 'manifest.json'))
+    jobs, input_hashes = [], {}
+    for instrument, year, key in expand_jobs(instruments, years, netcdf_dir):
+        path = netcdf_file(instrument, year, netcdf_dir)
+        if path not in input_hashes:
+            input_hashes[path] = store.file_hash(path)
+        h = store.entry_hash(input_hashes[path], instrument, key, *band_parameters(instrument, year))
+        jobs.append((instrument, year, key, h))
+    pending = [job for job in jobs if not manifest.finished(job)]
+    print(f'{len(jobs)} jobs, {len(jobs) - len(pending)} already done')
+
+    close_mooring_data() # the channels were listed here, the workers open their own files
+    failed = []
+    worker = partial(run_job, netcdf_dir=netcdf_dir, store_dir=store_dir)
+    with (Pool(processes) if pool is None else nullcontext(pool)) as pool:
+        for job, status in pool.imap_unordered(worker, pending):
+            print(job_name(job), status)
+            if status.startswith('failed'):
+                failed.append(job)
+                continue
+            manifest.record(job, status)
+            if status == 'done':
+                store.register(*job)
+                store.save_index()
+    if stage_timing.enabled and stage_timing._log is not None:
+        print(stage_timing.summary(log=stage_timing._log, run=stage_timing.run_id))
+    return failed
+
+
+def regrid_store(out_dir, instruments, years, per_decade=20, fmin=1e-3, fmax=1e2):
+    ''' every stored (instrument, year, depth) spectrum on one log frequency grid, in a single pass
+
+    degrees of freedom follow each spectrum (see stitched_dof), so they can be averaged across
+    years or depths with spectral_tools.aggregate_spectra. Saved to out_dir/log_spectra.npz
+    and returned as a dictionnary (instrument, year, key: one entry per spectrum, keys are strings, the depth
+    or the aquadopp variable; freq, edges; psd, dof: nspectra x nbins)
+    '''
+    store = SpectraStore(os.path.join(out_dir, 'store'))
+    edges, centers = log_frequencies(fmin, fmax, per_decade)
+    labels, freqs, psds, dofs = [], [], [], []
+    for instrument in instruments:
+        for year in years:
+            for key in store.keys(instrument, year):
+                h = store.index[instrument][str(year)][str(key)]['hash']
+                spectrum, meta = store.load_object(h), store.meta(h)
+                freq = spectrum['freq']
+                # entries written before nt was recorded: the periodogram resolution gives it
+                nt = meta.get('nt') or int(round(1./(freq[1]*meta['dt'])))
+                labels.append((instrument, int(year), str(key)))
+                freqs.append(freq)
+                psds.append(spectrum['psd'])
+                dofs.append(stitched_dof(meta['dt'], meta['windows'], meta['lims'], nt))
+    with stage('regrid'):
+        psd, dof = log_regrid(freqs, psds, edges, dofs)
+    res = {'instrument': np.array([l[0] for l in labels]), 'year': np.array([l[1] for l in labels], dtype=int),
+           'key': np.array([l[2] for l in labels]), 'freq': centers, 'edges': edges, 'psd': psd, 'dof': dof}
+    np.savez(os.path.join(out_dir, 'log_spectra.npz'), **res)
+    return res
@@ -0,0 +1,134 @@
+''' content-addressed store for the power spectra
+an entry is identified by the hash of its input netcdf file, the quantity, the channel and the spectral parameters
+(dt, windows, lims): unchanged inputs are never recomputed, changed parameters only invalidate
+the entries they touch. Arrays are plain .npy files, loaded lazily with memory mapping
+
+layout:
+    root/index.json                    {instrument: {year: {str(key): {'key': key, 'hash': hash}}}}
+    root/file_hashes.json              cache of netcdf hashes, keyed by path, size and mtime
+    root/objects/{hash}/freq.npy
+    root/objects/{hash}/psd.npy
+    root/objects/{hash}/meta.json
+'''
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+def _dump_json(obj, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class SpectraStore:
+    ''' spectra store rooted in a directory (e.g. support_data/PowerSpectra/store)
+
+    E.g.
+        store = SpectraStore('../support_data/PowerSpectra/store')
+        psd = store.get('rbr', 2015, 1000.0)['psd'] # memory mapped, nothing else is read
+    '''
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.index = _load_json(os.path.join(root, 'index.json'))
+
+    # ---- hashing
+    def file_hash(self, path, blocksize=2**22):
+        ''' sha1 of a file content, cached as long as the file size and mtime do not change '''
+        cache_path = os.path.join(self.root, 'file_hashes.json')
+        cache = _load_json(cache_path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        apath = os.path.abspath(path)
+        if apath in cache and cache[apath]['stamp'] == stamp:
+            return cache[apath]['sha1']
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(blocksize), b''):
+                sha.update(block)
+        cache[apath] = {'stamp': stamp, 'sha1': sha.hexdigest()}
+        _dump_json(cache, cache_path)
+        return cache[apath]['sha1']
+
+    @staticmethod
+    def entry_hash(input_hash, quantity, key, dt, windows, lims):
+        ''' hash of one spectrum: input file, derived quantity (e.g. instrument name), channel and spectral parameters '''
+        params = json.dumps([input_hash, quantity, str(key), repr(float(dt)),
+                             [repr(float(w)) for w in windows], [repr(float(l)) for l in lims]])
+        return hashlib.sha1(params.encode()).hexdigest()
+
+    # ---- objects
+    def _object_dir(self, h):
+        return os.path.join(self.root, 'objects', h)
+
+    def has(self, h):
+        return os.path.exists(os.path.join(self._object_dir(h), 'meta.json'))
+
+    def put(self, h, freq, psd, meta=None):
+        ''' write one entry, atomically (safe to call from pool workers) '''
+        if self.has(h):
+            return
+        tmp = tempfile.mkdtemp(dir=os.path.join(self.root, 'objects'))
+        np.save(os.path.join(tmp, 'freq.npy'), np.asarray(freq))
+        np.save(os.path.join(tmp, 'psd.npy'), np.asarray(psd))
+        _dump_json(meta or {}, os.path.join(tmp, 'meta.json'))
+        try:
+            os.rename(tmp, self._object_dir(h))
+        except OSError: # written meanwhile by another process
+            shutil.rmtree(tmp)
+
+    def load_object(self, h, mmap_mode='r'):
+        path = self._object_dir(h)
+        return {'freq': np.load(os.path.join(path, 'freq.npy'), mmap_mode=mmap_mode),
+                'psd': np.load(os.path.join(path, 'psd.npy'), mmap_mode=mmap_mode)}
+
+    def meta(self, h):
+        with open(os.path.join(self._object_dir(h), 'meta.json'), 'r') as f:
+            return json.load(f)
+
+    # ---- index
+    def register(self, instrument, year, key, h):
+        ''' point (instrument, year, key) to the entry h, call save_index() afterwards '''
+        entries = self.index.setdefault(instrument, {}).setdefault(str(year), {})
+        entries[str(key)] = {'key': key, 'hash': h}
+
+    def save_index(self):
+        _dump_json(self.index, os.path.join(self.root, 'index.json'))
+
+    def keys(self, instrument, year):
+        ''' channels (depths) available for an instrument/year '''
+        entries = self.index.get(instrument, {}).get(str(year), {})
+        return [e['key'] for e in entries.values()]
+
+    def get(self, instrument, year, key, mmap_mode='r'):
+        ''' {'freq', 'psd'} of a single channel '''
+        h = self.index[instrument][str(year)][str(key)]['hash']
+        return self.load_object(h, mmap_mode=mmap_mode)
+
+    def load(self, instrument, year, mmap_mode='r'):
+        ''' {key: {'freq', 'psd'}} for an instrument/year, same layout as the psd_{instrument}_{year} pickles '''
+        return {key: self.get(instrument, year, key, mmap_mode=mmap_mode)
+                for key in self.keys(instrument, year)}
+
+    def prune(self):
+        ''' delete the objects not referenced by the index anymore, returns their number '''
+        used = {e['hash'] for years in self.index.values() for entries in years.values()
+                for e in entries.values()}
+        removed = 0
+        for h in os.listdir(os.path.join(self.root, 'objects')):
+            if h not in used:
+                shutil.rmtree(self._object_dir(h))
+                removed += 1
+        return removed
@@ -0,0 +1,494 @@
+''' spectral routines shared by the PowerSpectra scripts and notebooks
+band-stitched PSD: periodogram at the lowest frequencies, then Welch estimates
+with shorter and shorter segments as frequency increases (see windows/lims)
+'''
+import warnings
+import numpy as np
+import scipy.signal as sg
+
+# typical frequencies at the mooring (cpd)
+lat = 37 + .17/.6
+f = 2*np.sin(lat*np.pi/180) # inertial
+M2 = 24/12.42
+S2 = 2
+M4 = 24/6.21
+M6 = 24/4.14
+week = 1./7
+month = 1./30
+yearly = 1./365
+
+# band tables: windows (days) and limit frequencies (cpd)
+# windows[i] is used for lims[i] <= f < lims[i+1], windows[-1] for f >= lims[-1]
+BANDS = {'temperature': (np.array([49, 35, 10, 2, 0.5]), [0.08, 1, 3, 10, 20]),
+         'aquadopp': (np.array([100, 20, 10, 2, 0.5]), [0.08, 1.2, 3, 10, 20]),
+         }
+
+
+def band_table(windows, lims, dt, nt):
+    ''' list of (nperseg, fmin, fmax) for each stitched band
+
+    first band is the full-length periodogram (nperseg=None) below lims[0].
+    windows are in days, dt in days, so nperseg = windows/dt (truncated like sg.welch does)
+    '''
+    windows = np.asarray(windows, dtype=float)
+    table = [(None, 0., lims[0])]
+    for i in range(len(lims)-1):
+        table.append((min(int(windows[i]/dt), nt), lims[i], lims[i+1]))
+    table.append((min(int(windows[-1]/dt), nt), lims[-1], np.inf))
+    return table
+
+
+def _band_selection(table, dt, nt):
+    ''' indices of the rfft frequencies kept in each band of a band_table '''
+    selection = []
+    for nperseg, fmin, fmax in table:
+        freq = np.fft.rfftfreq(nt if nperseg is None else nperseg, dt)
+        ind, = np.where((freq >= fmin) & (freq < fmax))
+        selection.append(ind)
+    return selection
+
+
+def stitched_psd(data, dt, windows, lims, axis=0):
+    ''' band-stitched power spectral density for every channel of a block in one pass
+
+    Parameters:
+    -----------
+    :param 1: data, time series to analyse, time along axis
+    :type 1: numpy ndarray (rank 1 or 2, e.g. time x depth)
+
+    :param 2: dt, sampling interval (days), frequencies are then in cpd
+    :type 2: float
+
+    :param 3: windows, segment length of each band (days), see BANDS
+    :type 3: array-like
+
+    :param 4: lims, limit frequencies between bands (cpd), see BANDS
+    :type 4: list
+
+    :param 5: axis (optional, default=0): time axis of data
+    :type 5: int
+
+    Returned:
+    ---------
+    :return: freq, psd: stitched frequencies and psd (frequency along axis, other axes untouched)
+    :rtype: ndarray (rank 1), ndarray (same rank as data)
+    '''
+    data = np.moveaxis(np.asarray(data), axis, -1)
+    nt = data.shape[-1]
+    table = band_table(windows, lims, dt, nt)
+
+    # frequencies only depend on the segment length: build the output layout first
+    selection = _band_selection(table, dt, nt)
+    nfreq = sum(len(ind) for ind in selection)
+    freq_out = np.empty(nfreq)
+    psd_out = np.empty(data.shape[:-1] + (nfreq,))
+
+    i0 = 0
+    for (nperseg, fmin, fmax), ind in zip(table, selection):
+        if len(ind) == 0:
+            continue
+        if nperseg is None:
+            freq, psd = sg.periodogram(data, fs=1./dt, axis=-1)
+        else:
+            freq, psd = sg.welch(data, fs=1./dt, window='hann', nperseg=nperseg, noverlap=0, axis=-1)
+        freq_out[i0:i0+len(ind)] = freq[ind]
+        psd_out[..., i0:i0+len(ind)] = psd[..., ind]
+        i0 += len(ind)
+
+    return freq_out, np.moveaxis(psd_out, -1, axis)
+
+
+def stitched_psd_dict(Data, dt, windows, lims):
+    ''' stitched psd of a {key: 1D series} dictionnary, as stored in support_data/PowerSpectra
+
+    series of equal length are stacked and processed together with stitched_psd
+    returns {key: {'freq': freq, 'psd': psd}}
+    '''
+    groups = {}
+    for key in Data.keys():
+        groups.setdefault(len(Data[key]), []).append(key)
+
+    PowerSpectra = {}
+    for keys in groups.values():
+        block = np.stack([Data[key] for key in keys], axis=-1)
+        freq, psd = stitched_psd(block, dt, windows, lims, axis=0)
+        for j, key in enumerate(keys):
+            PowerSpectra[key] = {'freq': freq, 'psd': psd[:, j]}
+    return PowerSpectra
+
+
+def stitched_csd(data, dt, windows, lims, axis=0, max_gap=0.1, batch=64):
+    ''' band-stitched cross-spectral density matrix of every pair of channels (e.g. depths)
+
+    each band is processed like in stitched_psd (non-overlapping Hann segments of windows[i] days,
+    mean removed), but every segment of every channel is Fourier transformed once and the matrix comes
+    from batched products, Pxy = conj(X) Y as in sg.csd. The lowest band (periodogram in stitched_psd,
+    a single segment whose coherence is 1 by construction) uses segments of windows[0] days.
+    Gaps are handled per channel and per pair: a channel uses a segment if at most max_gap of it is NaN,
+    the missing samples are set to the segment mean and its spectrum is rescaled by the window energy
+    of the valid samples; every pair is averaged over the segments used by both of its channels
+    (a pair with a single segment has coherence 1, check nseg)
+
+    Parameters:
+    -----------
+    :param 1: data, (time x depth) block, time along axis (e.g. a LazyBlock, padded with NaN)
+    :param 2: dt, windows, lims: as in stitched_psd
+    :param 3: max_gap (optional, default=0.1): largest fraction of NaN in a segment of a channel
+    :param 4: batch (optional, default=64): segments transformed at once (bounds memory)
+
+    Returned:
+    ---------
+    :return: freq, csd, nseg, power: frequencies, (depth x depth x freq) complex csd, number of segments
+             of each pair and psd of channel i over the segments of pair (i, j) (see coherence_phase)
+    :rtype: ndarray (rank 1), ndarray (rank 3), ndarray (rank 3), ndarray (rank 3)
+    '''
+    data = np.moveaxis(np.asarray(data, dtype=float), axis, 0)
+    nt, nchan = data.shape[0], data.shape[1]
+    windows = np.asarray(windows, dtype=float)
+    table = [(min(int(windows[0]/dt), nt), 0., lims[0])] + band_table(windows, lims, dt, nt)[1:]
+    selection = _band_selection(table, dt, nt)
+    nfreq = sum(len(ind) for ind in selection)
+    freq_out = np.empty(nfreq)
+    csd_out = np.zeros((nfreq, nchan, nchan), dtype=complex)
+    power_out = np.zeros((nfreq, nchan, nchan))
+    nseg_out = np.zeros((nfreq, nchan, nchan), dtype=int)
+
+    i0 = 0
+    for (nperseg, fmin, fmax), ind in zip(table, selection):
+        if len(ind) == 0:
+            continue
+        win = sg.get_window('hann', nperseg)
+        freq = np.fft.rfftfreq(nperseg, dt)[ind]
+        scale = np.full(len(ind), dt/(win**2).sum())
+        scale[(freq > 0) & ~((nperseg % 2 == 0) & (ind == nperseg//2))] *= 2 # one-sided
+        segments = sliding_windows(data, nperseg, nperseg, axis=0) # (segment, time, channel)
+        sl = slice(i0, i0+len(ind))
+        npair = np.zeros((nchan, nchan), dtype=int)
+        for s0 in range(0, len(segments), batch):
+            seg = segments[s0:s0+batch]
+            present = ~np.isnan(seg)
+            nvalid = present.sum(axis=1) # (segment, channel)
+            valid = nvalid >= (1 - max_gap)*nperseg
+            mean = np.where(present, seg, 0.).sum(axis=1, keepdims=True)/np.maximum(nvalid, 1)[:, None]
+            seg = np.where(present & valid[:, None], seg - mean, 0.)*win[None, :, None]
+            energy = (win**2) @ present/(win**2).sum() # fraction of the window energy on valid samples
+            X = np.fft.rfft(seg, axis=1)[:, ind] # (segment, freq, channel), 0 for the unused channels
+            X *= np.where(valid, 1/np.sqrt(np.maximum(energy, 1e-12)), 0.)[:, None]
+            csd_out[sl] += np.einsum('sfi,sfj->fij', X.conj(), X)
+            power_out[sl] += np.einsum('sfi,sj->fij', X.real**2 + X.imag**2, valid.astype(float))
+            npair += valid.T.astype(int) @ valid.astype(int)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            norm = np.where(npair > 0, 1./npair, np.nan)[None]*scale[:, None, None]
+        csd_out[sl] *= norm
+        power_out[sl] *= norm
+        freq_out[sl] = freq
+        nseg_out[sl] = npair
+        i0 += len(ind)
+
+    return (freq_out, np.moveaxis(csd_out, 0, -1), np.moveaxis(nseg_out, 0, -1), np.moveaxis(power_out, 0, -1))
+
+
+def coherence_phase(csd, power=None):
+    ''' magnitude squared coherence and phase (rad, of channel j relative to channel i) of a (depth x depth x freq) csd
+    power (optional): (depth x depth x freq) psd of channel i over the segments of pair (i, j), as returned by
+    stitched_csd, so each pair is normalised on its own segments. Default: the diagonal of csd
+    '''
+    if power is None:
+        diag = np.real(np.diagonal(csd, axis1=0, axis2=1)).T # (depth x freq)
+        power = np.broadcast_to(diag[:, None], csd.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coh = np.abs(csd)**2/(power*np.swapaxes(power, 0, 1))
+    return coh, np.angle(csd)
+
+
+def stitched_dof(dt, windows, lims, nt):
+    ''' degrees of freedom of each frequency of stitched_psd for a record of nt points:
+    2 for the periodogram, 2 per (non-overlapping, Hann) segment in the Welch bands
+    '''
+    table = band_table(windows, lims, dt, nt)
+    return np.concatenate([np.full(len(ind), 2. if nperseg is None else 2.*(nt//nperseg))
+                           for (nperseg, fmin, fmax), ind in zip(table, _band_selection(table, dt, nt))])
+
+
+def log_frequencies(fmin=1e-3, fmax=1e2, per_decade=20):
+    ''' edges and (geometric) centers of a log-spaced frequency grid shared by every instrument and year '''
+    edges = 10**np.arange(np.log10(fmin), np.log10(fmax) + 0.5/per_decade, 1./per_decade)
+    return edges, np.sqrt(edges[:-1]*edges[1:])
+
+
+def log_regrid(freqs, psds, edges, dofs=None):
+    ''' dof-weighted mean of many spectra in the bins of a shared log frequency grid, in one bincount
+
+    Parameters:
+    -----------
+    :param 1: freqs, psds: frequencies and psd of each spectrum (grids may differ, e.g. dt of the year)
+    :type 1: lists of 1D ndarrays
+
+    :param 2: edges, bin edges (see log_frequencies)
+    :type 2: ndarray
+
+    :param 3: dofs (optional, default=2 everywhere): degrees of freedom of each psd value (see stitched_dof)
+    :type 3: list of 1D ndarrays
+
+    Returned:
+    ---------
+    :return: psd, dof: (nspectra x nbins), NaN psd and 0 dof in empty bins
+    :rtype: ndarray, ndarray
+    '''
+    nspec, nbins = len(freqs), len(edges) - 1
+    freq = np.concatenate([np.asarray(fr, dtype=float) for fr in freqs])
+    psd = np.concatenate([np.asarray(p, dtype=float) for p in psds])
+    dof = np.full(len(freq), 2.) if dofs is None else np.concatenate([np.asarray(d, dtype=float) for d in dofs])
+    spec = np.repeat(np.arange(nspec), [len(fr) for fr in freqs])
+    ind = np.searchsorted(edges, freq, side='right') - 1
+    ok = (ind >= 0) & (ind < nbins) & np.isfinite(psd)
+    flat = (spec*nbins + ind)[ok]
+    dof_bin = np.bincount(flat, weights=dof[ok], minlength=nspec*nbins).reshape(nspec, nbins)
+    sum_bin = np.bincount(flat, weights=(dof*psd)[ok], minlength=nspec*nbins).reshape(nspec, nbins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(dof_bin > 0, sum_bin/dof_bin, np.nan), dof_bin
+
+
+def aggregate_spectra(psd, dof, axis=0, alpha=0.05):
+    ''' combine regridded spectra along axis (e.g. years or depths): dof-weighted mean, std across
+    spectra, total dof and chi-square confidence interval (1-alpha) of the mean. Returns a dictionnary
+    '''
+    from scipy.stats import chi2
+    psd = np.asarray(psd, dtype=float)
+    dof = np.where(np.isnan(psd), 0., dof)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # bins with a single spectrum have no spread
+        total = dof.sum(axis=axis)
+        mean = np.nansum(psd*dof, axis=axis)/total
+        mean = np.where(total > 0, mean, np.nan)
+        res = {'psd': mean, 'dof': total,
+               'std': np.nanstd(psd, axis=axis, ddof=1) if psd.shape[axis] > 1 else np.full(mean.shape, np.nan),
+               'lower': mean*total/chi2.ppf(1 - alpha/2, total),
+               'upper': mean*total/chi2.ppf(alpha/2, total),
+               'count': np.sum(dof > 0, axis=axis)}
+    return res
+
+
+def sliding_windows(data, nperseg, step, axis=0):
+    ''' (nwin, nperseg, ...) strided view of the segments of data along axis, no copy '''
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    view = np.lib.stride_tricks.sliding_window_view(data, nperseg, axis=0)[::step]
+    return np.moveaxis(view, -1, 1)
+
+
+class Spectrogram:
+    ''' time-resolved PSD of (time x depth) records, Hann windows, same normalization as sg.welch
+    (one segment per column). Records (e.g. deployment years) are appended one after the other,
+    windows never span two records and existing columns are never recomputed
+
+    Parameters:
+    -----------
+    :param 1: window, segment length (days)
+    :param 2: step (optional, default=window/2): time between successive windows (days)
+    :param 3: fmin, fmax (optional): band limits (cpd) of the stored frequencies, which also stop below
+              the smallest Nyquist frequency of the records (appending a record with a longer dt drops the
+              higher frequencies of the existing columns)
+    :param 4: batch (optional, default=64): windows transformed at once (bounds memory)
+
+    E.g.
+        spg = Spectrogram(window=10, fmin=0.5, fmax=10)
+        for year in years:
+            spg.append(time[year], temp[year], sampling_interval('sbe', year))
+        spg.time, spg.freq, spg.psd  # (nwin,), (nfreq,), (nwin, nfreq, ndepth)
+    '''
+    def __init__(self, window, step=None, fmin=0., fmax=np.inf, batch=64):
+        self.window = window
+        self.step = window/2. if step is None else step
+        self.fmin, self.fmax = fmin, fmax
+        self.batch = batch
+        self.freq = None
+        self._time = []
+        self._psd = []
+
+    def append(self, time, data, dt, axis=0):
+        ''' add the windows of a new record: time (days, along axis of data), data (time x depth), dt (days) '''
+        nperseg = int(round(self.window/dt))
+        step = max(int(round(self.step/dt)), 1)
+        freq = np.fft.rfftfreq(nperseg, dt)
+        ind, = np.where((freq >= self.fmin) & (freq < self.fmax) & (freq < 1/(2*dt)))
+        if self.freq is not None:
+            n = min(len(ind), len(self.freq))
+            if not np.allclose(freq[ind[:n]], self.freq[:n]):
+                raise ValueError(f'frequencies of dt={dt} do not match the spectrogram: '
+                                 f'window={self.window} days is not a whole number of samples of every record')
+            ind = ind[:n]
+            if n < len(self.freq): # lower Nyquist frequency than the previous records
+                self._psd = [psd[:, :n] for psd in self._psd]
+        self.freq = freq[ind]
+        data = np.moveaxis(np.asarray(data), axis, 0)
+        if data.shape[0] < nperseg:
+            return 0
+        segments = sliding_windows(data, nperseg, step, axis=0)
+        win = sg.get_window('hann', nperseg).reshape((1, nperseg) + (1,)*(data.ndim-1))
+        scale = dt/(win**2).sum() # density, as sg.welch
+        psd = np.empty((len(segments), len(ind)) + data.shape[1:])
+        for i0 in range(0, len(segments), self.batch):
+            seg = segments[i0:i0+self.batch]
+            seg = (seg - seg.mean(axis=1, keepdims=True))*win
+            spec = np.fft.rfft(seg, axis=1)[:, ind]
+            psd[i0:i0+self.batch] = (spec.real**2 + spec.imag**2)*scale
+        # one-sided: double everything but DC and Nyquist
+        double = (freq[ind] > 0) & ~((nperseg % 2 == 0) & (ind == nperseg//2))
+        psd[:, double] *= 2
+        centers = np.arange(len(segments))*step + nperseg//2
+        self._time.append(np.asarray(time)[centers])
+        self._psd.append(psd)
+        return len(segments)
+
+    @property
+    def time(self):
+        ''' window centers (same unit as the appended time) '''
+        return np.concatenate(self._time) if self._time else np.array([])
+
+    @property
+    def psd(self):
+        ''' (nwin, nfreq, ...) '''
+        return np.concatenate(self._psd) if self._psd else np.empty((0, 0))
+
+    def save(self, path):
+        np.savez(path, window=self.window, step=self.step, fmin=self.fmin, fmax=self.fmax,
+                 freq=self.freq, time=self.time, psd=self.psd, nwin=[len(t) for t in self._time])
+
+    @classmethod
+    def load(cls, path):
+        ''' spectrogram saved by save(), new records can be appended to it '''
+        with np.load(path) as f:
+            spg = cls(float(f['window']), float(f['step']), float(f['fmin']), float(f['fmax']))
+            spg.freq = f['freq']
+            bounds = np.cumsum(np.r_[0, f['nwin']])
+            spg._time = [f['time'][i0:i1] for i0, i1 in zip(bounds[:-1], bounds[1:])]
+            spg._psd = [f['psd'][i0:i1] for i0, i1 in zip(bounds[:-1], bounds[1:])]
+        return spg
+
+
+class WelchAccumulator:
+    ''' online, mergeable band-stitched Welch estimate of (time x depth) records
+    keeps, per band and depth, the sum and sum of squares of the segment periodograms and the number
+    of segments, so the spectra of several years (or chunks) merge exactly by adding partial sums.
+    Segments do not overlap (as in stitched_psd), segments with a NaN are skipped for that depth.
+    The lowest band (periodogram of the whole record in stitched_psd) uses segments of low_window days
+    and the highest band stops at fmax (default: Nyquist of the 12 min Aquadopp years, the slowest
+    sampling of the mooring), so that every record contributes on the same frequencies whatever its dt
+
+    E.g.
+        windows, lims = BANDS['temperature']
+        acc = WelchAccumulator(windows, lims, dt=sampling_interval('sbe', 2015))
+        for year in years:
+            acc.update(temp[year], sampling_interval('sbe', year))   # or merge stored accumulators
+        res = acc.result(alpha=0.05)   # freq, psd, lower, upper, std, dof
+    '''
+    def __init__(self, windows, lims, dt, low_window=180., fmax=60., batch=64):
+        self.windows = np.asarray(windows, dtype=float)
+        self.lims = np.asarray(lims, dtype=float)
+        self.dt = dt
+        self.low_window = float(low_window)
+        self.fmax = float(fmax)
+        if 1/(2*dt) < self.fmax:
+            raise ValueError(f'fmax={fmax} cpd is above the Nyquist frequency of dt={dt}')
+        self.batch = batch
+        self.segments = [self.low_window] + list(self.windows)
+        edges = np.r_[0., self.lims, self.fmax]
+        self.bands = list(zip(edges[:-1], edges[1:]))
+        self.freq = [self._frequencies(window, fmin, fmax, dt)[1] for window, (fmin, fmax) in zip(self.segments, self.bands)]
+        self.count = None
+
+    @staticmethod
+    def _frequencies(window, fmin, fmax, dt):
+        nperseg = int(window/dt)
+        freq = np.fft.rfftfreq(nperseg, dt)
+        ind, = np.where((freq >= fmin) & (freq < fmax))
+        return nperseg, freq[ind], ind
+
+    def _init(self, shape):
+        self.count = [np.zeros(shape) for _ in self.bands]
+        self.sum = [np.zeros((len(freq),) + shape) for freq in self.freq]
+        self.sumsq = [np.zeros((len(freq),) + shape) for freq in self.freq]
+
+    def update(self, data, dt, axis=0):
+        ''' add a record (time along axis) sampled every dt days (Nyquist frequency at least fmax), returns self '''
+        if 1/(2*dt) < self.fmax:
+            raise ValueError(f'dt={dt} is too long for fmax={self.fmax} cpd')
+        data = np.moveaxis(np.asarray(data, dtype=float), axis, 0)
+        if self.count is None:
+            self._init(data.shape[1:])
+        for b, (window, (fmin, fmax)) in enumerate(zip(self.segments, self.bands)):
+            nperseg, freq, ind = self._frequencies(window, fmin, fmax, dt)
+            if len(freq) != len(self.freq[b]) or not np.allclose(freq, self.freq[b]):
+                raise ValueError(f'frequencies of dt={dt} do not match the accumulator in band {fmin}-{fmax} cpd')
+            if len(ind) == 0 or data.shape[0] < nperseg:
+                continue
+            segments = sliding_windows(data, nperseg, nperseg, axis=0)
+            win = sg.get_window('hann', nperseg).reshape((1, nperseg) + (1,)*(data.ndim-1))
+            scale = dt/(win**2).sum()
+            double = (freq > 0) & ~((nperseg % 2 == 0) & (ind == nperseg//2))
+            scale = np.where(double, 2*scale, scale).reshape((1, -1) + (1,)*(data.ndim-1))
+            for i0 in range(0, len(segments), self.batch):
+                seg = segments[i0:i0+self.batch]
+                valid = ~np.isnan(seg).any(axis=1)
+                seg = np.where(valid[:, None], seg - seg.mean(axis=1, keepdims=True), 0.)*win
+                spec = np.fft.rfft(seg, axis=1)[:, ind]
+                pxx = (spec.real**2 + spec.imag**2)*scale
+                self.sum[b] += pxx.sum(axis=0)
+                self.sumsq[b] += (pxx**2).sum(axis=0)
+                self.count[b] += valid.sum(axis=0)
+        return self
+
+    def merge(self, other):
+        ''' merge another accumulator (same bands and frequencies) in place, returns self '''
+        if other.count is None:
+            return self
+        if len(other.freq) != len(self.freq) or not all(len(a) == len(b) and np.allclose(a, b)
+                                                         for a, b in zip(self.freq, other.freq)):
+            raise ValueError('accumulators with different bands or frequencies')
+        if self.count is None:
+            self._init(other.count[0].shape)
+        for b in range(len(self.bands)):
+            self.count[b] = self.count[b] + other.count[b]
+            self.sum[b] = self.sum[b] + other.sum[b]
+            self.sumsq[b] = self.sumsq[b] + other.sumsq[b]
+        return self
+
+    def result(self, alpha=0.05):
+        ''' stitched mean psd (frequency along axis 0) with its chi-square confidence interval (1-alpha),
+        std of the segment periodograms and degrees of freedom (2 per non-overlapping Hann segment)
+        '''
+        from scipy.stats import chi2
+        res = {k: [] for k in ['psd', 'std', 'lower', 'upper', 'dof']}
+        for b in range(len(self.bands)):
+            n = np.broadcast_to(self.count[b], self.sum[b].shape)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(n > 0, self.sum[b]/n, np.nan)
+                var = np.where(n > 1, (self.sumsq[b] - n*mean**2)/(n - 1), np.nan)
+                dof = 2*n
+                res['psd'].append(mean)
+                res['std'].append(np.sqrt(np.maximum(var, 0)))
+                res['lower'].append(mean*dof/chi2.ppf(1 - alpha/2, dof))
+                res['upper'].append(mean*dof/chi2.ppf(alpha/2, dof))
+                res['dof'].append(dof)
+        res = {k: np.concatenate(v, axis=0) for k, v in res.items()}
+        res['freq'] = np.concatenate(self.freq)
+        return res
+
+    def save(self, path):
+        ''' partial sums (.npz), to be merged with the ones of other years later '''
+        arrays = {'windows': self.windows, 'lims': self.lims, 'dt': self.dt, 'low_window': self.low_window,
+                  'fmax': self.fmax}
+        if self.count is not None:
+            for b in range(len(self.bands)):
+                arrays.update({f'count_{b}': self.count[b], f'sum_{b}': self.sum[b], f'sumsq_{b}': self.sumsq[b]})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            acc = cls(f['windows'], f['lims'], float(f['dt']), float(f['low_window']), float(f['fmax']))
+            if 'count_0' in f:
+                acc.count = [f[f'count_{b}'] for b in range(len(acc.bands))]
+                acc.sum = [f[f'sum_{b}'] for b in range(len(acc.bands))]
+                acc.sumsq = [f[f'sumsq_{b}'] for b in range(len(acc.bands))]
+        return acc
@@ -0,0 +1,140 @@
+''' stage-level instrumentation of the processing scripts (read, density, filter, spectral, store, render)
+records wall time, CPU time, bytes read and (optionally) peak python/numpy allocations per stage and
+labels (instrument, year, depth), as json lines in a log, with an end-of-run summary table.
+Disabled by default: stage() then returns a shared no-op context and timed() a single flag test,
+so the instrumentation can stay in production code.
+
+Enable it with enable(log=...) or with the environment variable MOMAR_TIMING=<log file>
+(inherited by pool workers), e.g.
+    MOMAR_TIMING=timing.jsonl python PowerSpectraBatch.py rbr --years 2015
+Records are tagged with the id of the run (MOMAR_TIMING_RUN, set by enable() and inherited by the workers),
+so the summary of a run only counts its own records of a log shared by successive runs
+
+    with stage('read', instrument='rbr', year=2015, depth=1000):
+        ...
+    @timed('filter')
+    def lowfreq_filt(...):
+'''
+import os
+import json
+import time
+import functools
+from contextlib import nullcontext
+
+enabled = False
+run_id = None
+_log = None
+_memory = False
+_records = []
+_stack = []
+_null = nullcontext()
+
+
+def enable(log=None, memory=False):
+    ''' start recording; log: json lines file (appended, shared by processes), memory: trace peak allocations '''
+    global enabled, run_id, _log, _memory
+    enabled, _log, _memory = True, log, memory
+    run_id = os.environ.get('MOMAR_TIMING_RUN') or f'{os.getpid()}-{time.time():.6f}'
+    os.environ['MOMAR_TIMING_RUN'] = run_id # workers of this run, forked or spawned, share its id
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+class _Stage:
+    def __init__(self, name, labels):
+        self.record = {'stage': name, **{k: (v if isinstance(v, (int, float, str)) else str(v))
+                                         for k, v in labels.items()}}
+        self.record['bytes_read'] = 0
+        self.peak = 0
+
+    def __enter__(self):
+        if _memory:
+            import tracemalloc
+            if _stack: # keep the peak of the outer stage before resetting it for this one
+                _stack[-1].peak = max(_stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        _stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _stack.pop()
+        rec = self.record
+        rec['wall_s'] = time.perf_counter() - self.wall
+        rec['cpu_s'] = time.process_time() - self.cpu
+        if _memory:
+            import tracemalloc
+            rec['peak_mb'] = max(self.peak, tracemalloc.get_traced_memory()[1])/2**20
+        rec['pid'] = os.getpid()
+        rec['run'] = run_id
+        if _stack: # bytes read in a nested stage also count for the outer ones
+            _stack[-1].record['bytes_read'] += rec['bytes_read']
+        _records.append(rec)
+        if _log is not None:
+            with open(_log, 'a') as f:
+                f.write(json.dumps(rec) + '\n')
+        return False
+
+
+def stage(name, **labels):
+    ''' context manager timing a stage, labels e.g. instrument, year, depth '''
+    if not enabled:
+        return _null
+    return _Stage(name, labels)
+
+
+def timed(name):
+    ''' decorator timing every call of a function as a stage '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Stage(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_bytes(nbytes):
+    ''' account bytes read by the current stage '''
+    if enabled and _stack:
+        _stack[-1].record['bytes_read'] += int(nbytes)
+
+
+def records(log=None, run=None):
+    ''' records of this process, or of every process from a log file, only those of run if given (e.g. run_id) '''
+    if log is None:
+        recs = list(_records)
+    else:
+        with open(log, 'r') as f:
+            recs = [json.loads(line) for line in f if line.strip()]
+    return recs if run is None else [r for r in recs if r.get('run') == run]
+
+
+def summary(recs=None, log=None, run=None):
+    ''' table of count, wall, CPU, bytes read and peak memory per stage (nested stages are included in their parents) '''
+    recs = records(log, run) if recs is None else recs
+    table = {}
+    for r in recs:
+        t = table.setdefault(r['stage'], {'n': 0, 'wall': 0., 'cpu': 0., 'bytes': 0, 'peak': 0.})
+        t['n'] += 1
+        t['wall'] += r['wall_s']
+        t['cpu'] += r['cpu_s']
+        t['bytes'] += r.get('bytes_read', 0)
+        t['peak'] = max(t['peak'], r.get('peak_mb', 0.))
+    lines = [f"{'stage':12s} {'calls':>6s} {'wall (s)':>10s} {'cpu (s)':>10s} {'read (MB)':>10s} {'peak (MB)':>10s}"]
+    for name, t in sorted(table.items(), key=lambda item: -item[1]['wall']):
+        lines.append(f"{name:12s} {t['n']:6d} {t['wall']:10.3f} {t['cpu']:10.3f} {t['bytes']/2**20:10.1f} {t['peak']:10.1f}")
+    return '\n'.join(lines)
+
+
+if os.environ.get('MOMAR_TIMING'):
+    enable(log=os.environ['MOMAR_TIMING'], memory=bool(os.environ.get('MOMAR_TIMING_MEMORY')))
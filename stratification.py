@@ -0,0 +1,99 @@
+''' ambient stratification N(z) at the mooring
+the Brunt-Vaisala frequency profile is built once per deployment from the time-mean SBE
+temperature/salinity/pressure, saved, and then served by vectorized lookups at any depths.
+Loaded profiles are cached, so figure annotation, PSD normalization and depth-dependent analyses
+share one profile instead of reading it again
+
+E.g.
+    prof = load_profile('../support_data/bvs_lucky.pkl')
+    N = prof(np.array([800, 1000, 1700]))  # s^-1
+'''
+import os
+import pickle
+import numpy as np
+
+_profiles = {}
+
+
+class StratificationProfile:
+    ''' N(z) profile: z (m, positive down) and N (s^-1), lookups by interpolation on the sorted depths '''
+    def __init__(self, z, N, N2=None, year=None):
+        z = np.ma.filled(np.ma.asarray(z, dtype=float), np.nan).ravel()
+        N = np.ma.filled(np.ma.asarray(N, dtype=float), np.nan).ravel()
+        ok = ~np.isnan(z) & ~np.isnan(N)
+        order = np.argsort(z[ok])
+        self.z = z[ok][order]
+        self.N = N[ok][order]
+        self.N2 = None if N2 is None else np.ma.filled(np.ma.asarray(N2, dtype=float), np.nan).ravel()[ok][order]
+        self.year = year
+
+    def __call__(self, depths, method='linear'):
+        ''' N (s^-1) at depths (scalar or array); 'linear' interpolation (constant beyond the ends) or 'nearest' '''
+        depths = np.asarray(depths, dtype=float)
+        if method == 'nearest' and len(self.z) > 1:
+            i = np.clip(np.searchsorted(self.z, depths), 1, len(self.z) - 1)
+            left = np.abs(depths - self.z[i - 1]) <= np.abs(self.z[i] - depths)
+            return self.N[np.where(left, i - 1, i)]
+        if method == 'nearest':
+            return np.full(depths.shape, self.N[0])[()]
+        return np.interp(depths, self.z, self.N)
+
+    def save(self, path):
+        np.savez(path, z=self.z, N=self.N, N2=self.N2 if self.N2 is not None else np.full_like(self.N, np.nan),
+                 year=np.array(-1 if self.year is None else int(self.year)))
+
+    @classmethod
+    def from_file(cls, path):
+        ''' profile saved by save() (.npz) or the legacy bvs_lucky.pkl ({'z', 'BVF'}) '''
+        if path.endswith('.npz'):
+            with np.load(path) as f:
+                year = int(f['year'])
+                return cls(f['z'], f['N'], f['N2'], None if year < 0 else year)
+        with open(path, 'rb') as f:
+            ambient_stratification = pickle.load(f)
+        return cls(ambient_stratification['z'], ambient_stratification['BVF'])
+
+
+def load_profile(path):
+    ''' profile of a file, read once per process '''
+    key = os.path.abspath(path)
+    if key not in _profiles:
+        _profiles[key] = StratificationProfile.from_file(path)
+    return _profiles[key]
+
+
+def build_profile(md, year, chunksize=2**16):
+    ''' N(z) from the time-mean sbe profile of a deployment year (MooringData md)
+    the absolute salinity is the one of the density stage (seawater.sbe_density),
+    levels without TEMP, PSAL or PRES are ignored, N2 < 0 gives N = 0
+    '''
+    import gsw
+    from seawater import lat, sbe_density
+    depths, _, missing, SA = sbe_density(md, year, chunksize=chunksize, return_sa=True)
+    levels = [level for level, depth in enumerate(depths) if depth not in missing]
+    sums = np.zeros((3, len(levels)))
+    counts = np.zeros((3, len(levels)))
+    nt = len(SA)
+    temp, pres = [md.lazy('sbe', year, var, length=nt) for var in ['TEMP', 'PRES']]
+    for i0 in range(0, nt, chunksize):
+        sl = slice(i0, min(i0 + chunksize, nt))
+        p = pres[sl, levels]
+        sa = SA[sl][:, levels]
+        ct = gsw.CT_from_t(sa, temp[sl, levels], p)
+        for k, x in enumerate([sa, ct, p]):
+            sums[k] += np.nansum(x, axis=0)
+            counts[k] += np.sum(~np.isnan(x), axis=0)
+    sa, ct, p = sums/counts
+    order = np.argsort(p)
+    sa, ct, p = sa[order], ct[order], p[order]
+    N2, p_mid = gsw.Nsquared(sa, ct, p, lat)
+    z = -gsw.z_from_p(p_mid, lat)
+    return StratificationProfile(z, np.sqrt(np.maximum(N2, 0)), N2, year)
+
+
+def build_profiles(md, years, out_dir):
+    ''' build and save stratification_{year}.npz for every deployment year with an sbe file '''
+    os.makedirs(out_dir, exist_ok=True)
+    for year in years:
+        if md.exists('sbe', year):
+            build_profile(md, year).save(os.path.join(out_dir, f'stratification_{year}.npz'))
@@ -0,0 +1,99 @@
+''' deterministic synthetic mooring data in the layouts of the real netcdf files
+{netcdf_dir}/{year}/rbr.nc (TEMP time x depth), sbe.nc (one group per depth with TEMP, PSAL, PRES)
+and aquadopp.nc (HCSP, HCDT), at the real sampling intervals of each instrument and year.
+Series are a mean profile plus tidal lines (M2, S2, M4, M6, f), red noise and NaN gaps,
+so the analysis scripts and benchmarks can run without the private netcdf tree
+
+E.g.
+    generate('/tmp/netcdf', years=[2015, 2016], days=30)
+'''
+import os
+import numpy as np
+from netCDF4 import Dataset
+from spectral_tools import f, M2, S2, M4, M6
+from spectra_batch import sampling_interval
+
+RBR_DEPTHS = np.arange(800., 1750., 50.) # 19 levels
+SBE_DEPTHS = np.array([800., 1000., 1200., 1350., 1500., 1688.])
+TIDES = {M2: 0.05, S2: 0.02, M4: 0.01, M6: 0.005, f: 0.02} # cpd: amplitude (degC)
+
+
+def _rng(seed, year, instrument):
+    return np.random.default_rng([seed, int(year), sum(map(ord, instrument))])
+
+
+def red_noise(rng, nt, nchan, alpha=0.999, sigma=0.01):
+    ''' AR(1) noise, (nt x nchan) '''
+    from scipy.signal import lfilter
+    return lfilter([sigma], [1, -alpha], rng.standard_normal((nt, nchan)), axis=0)
+
+
+def synthetic_block(rng, time, depths, mean, gradient, tides=TIDES, gaps=3, noise=0.01):
+    ''' (time x depth) series: mean + gradient*depth + tidal lines (phase varying with depth) + red noise
+    time in days, gaps contiguous NaN gaps per level
+    '''
+    nt, nd = len(time), len(depths)
+    data = mean + gradient*depths[None, :] + red_noise(rng, nt, nd, sigma=noise)
+    for freq, amp in tides.items():
+        phase = rng.uniform(0, 2*np.pi) + depths/500.
+        data += amp*np.cos(2*np.pi*freq*time[:, None] + phase[None, :])
+    for j in range(nd):
+        for _ in range(gaps):
+            i0 = rng.integers(0, max(nt - 10, 1))
+            data[i0:i0 + rng.integers(1, max(nt//200, 2)), j] = np.nan
+    return data
+
+
+def _time(year, instrument, days):
+    dt = sampling_interval(instrument, year)
+    t0 = (int(year) - 1950)*365.25 + 180 # deployments start mid-year, days since 1950-01-01
+    return t0 + np.arange(int(days/dt))*dt
+
+
+def write_rbr(path, year, days=365, seed=0, depths=RBR_DEPTHS):
+    rng = _rng(seed, year, 'rbr')
+    time = _time(year, 'rbr', days)
+    temp = synthetic_block(rng, time, depths, 11., -0.004)
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('TIME', len(time))
+        nc.createDimension('DEPTH', len(depths))
+        nc.createVariable('TIME', 'f8', ('TIME',))[:] = time
+        nc.createVariable('DEPTH', 'f4', ('DEPTH',))[:] = depths
+        nc.createVariable('TEMP', 'f4', ('TIME', 'DEPTH'), fill_value=np.nan)[:] = temp
+
+
+def write_sbe(path, year, days=365, seed=0, depths=SBE_DEPTHS):
+    rng = _rng(seed, year, 'sbe')
+    time = _time(year, 'sbe', days)
+    temp = synthetic_block(rng, time, depths, 11., -0.004)
+    psal = synthetic_block(rng, time, depths, 35.6, -0.0002, tides={M2: 0.005}, noise=0.001)
+    pres = 1.01*depths[None, :] + synthetic_block(rng, time, depths, 0., 0., tides={M2: 1.}, gaps=0, noise=0.1)
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('DEPTH', len(depths))
+        nc.createVariable('DEPTH', 'i4', ('DEPTH',))[:] = depths
+        for j, d in enumerate(depths):
+            grp = nc.createGroup(str(int(d)))
+            grp.createDimension('TIME', len(time))
+            grp.createVariable('TIME', 'f8', ('TIME',))[:] = time
+            for name, values in [('TEMP', temp), ('PSAL', psal), ('PRES', pres)]:
+                grp.createVariable(name, 'f4', ('TIME',), fill_value=np.nan)[:] = values[:, j]
+
+
+def write_aquadopp(path, year, days=365, seed=0):
+    rng = _rng(seed, year, 'aquadopp')
+    time = _time(year, 'aquadopp', days)
+    u, v = synthetic_block(rng, time, np.zeros(2), 0.02, 0., tides={M2: 0.05, f: 0.02}, noise=0.005).T
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('TIME', len(time))
+        nc.createVariable('TIME', 'f8', ('TIME',))[:] = time
+        nc.createVariable('HCSP', 'f4', ('TIME',), fill_value=np.nan)[:] = np.hypot(u, v)
+        nc.createVariable('HCDT', 'f4', ('TIME',), fill_value=np.nan)[:] = np.degrees(np.arctan2(u, v)) % 360
+
+
+def generate(netcdf_dir, years=range(2011, 2020), days=365, seed=0, instruments=('rbr', 'sbe', 'aquadopp')):
+    ''' write the synthetic files of every year and instrument (days: record length per year) '''
+    writers = {'rbr': write_rbr, 'sbe': write_sbe, 'aquadopp': write_aquadopp}
+    for year in years:
+        os.makedirs(os.path.join(netcdf_dir, str(year)), exist_ok=True)
+        for instrument in instruments:
+            writers[instrument](os.path.join(netcdf_dir, str(year), f'{instrument}.nc'), year, days=days, seed=seed)
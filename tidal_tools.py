@@ -0,0 +1,150 @@
+''' least-squares harmonic analysis of the tidal (and inertial) lines at the mooring
+amplitudes and phases of M2, S2, M4, M6 and f for every depth at once: the design matrix is built
+once per time base and shared by all channels, and by all sliding windows of a uniformly sampled record.
+Channels with NaN gaps only correct their normal equations for the missing samples
+
+E.g.
+    hf = HarmonicFit(time)                  # time (days)
+    res = hf.fit(temp)                      # temp: time x depth
+    res['amplitude'][:, hf.names.index('M2')]
+or, for amplitude versus depth and time,
+    res = fit_windows(time, temp, dt, window=30, step=15)
+'''
+import warnings
+import numpy as np
+from spectral_tools import f, M2, S2, M4, M6, sliding_windows
+
+CONSTITUENTS = {'M2': M2, 'S2': S2, 'M4': M4, 'M6': M6, 'f': f} # cpd
+
+
+def design_matrix(time, freqs):
+    ''' columns [1, cos(2 pi f1 t), sin(2 pi f1 t), cos(2 pi f2 t), ...], time in days and freqs in cpd '''
+    arg = 2*np.pi*np.outer(np.asarray(time, dtype=float), freqs)
+    A = np.empty((len(arg), 1 + 2*len(freqs)))
+    A[:, 0] = 1.
+    A[:, 1::2] = np.cos(arg)
+    A[:, 2::2] = np.sin(arg)
+    return A
+
+
+class HarmonicFit:
+    ''' least-squares fit of x(t) = mean + sum_k a_k cos(2 pi f_k t) + b_k sin(2 pi f_k t) on a time base
+
+    Parameters:
+    -----------
+    :param 1: time, sampling times (days)
+    :param 2: constituents (optional, default=CONSTITUENTS): {name: frequency (cpd)}
+    :param 3: min_valid (optional, default=0.5): minimum fraction of valid samples of a channel,
+              channels with less (or with a singular system) give NaN
+
+    Phases are in degrees, relative to time = 0, with x = A cos(2 pi f t - phase)
+    '''
+    def __init__(self, time, constituents=CONSTITUENTS, min_valid=0.5):
+        self.time = np.asarray(time, dtype=float)
+        self.names = list(constituents.keys())
+        self.freqs = np.array([constituents[k] for k in self.names], dtype=float)
+        self.min_valid = min_valid
+        self.A = design_matrix(self.time, self.freqs)
+        self.G = self.A.T @ self.A # normal matrix of gap-free channels
+
+    def coefficients(self, data):
+        ''' (nparam x channels) coefficients of a (time x channels) block (rank 1 or 2), NaN ignored '''
+        data = np.asarray(data, dtype=float)
+        shape = data.shape[1:]
+        data = data.reshape(len(data), -1)
+        valid = ~np.isnan(data)
+        rhs = self.A.T @ np.where(valid, data, 0.)
+        coef = np.full(rhs.shape, np.nan)
+        nvalid = valid.sum(axis=0)
+        enough = nvalid >= self.min_valid*len(data)
+        full = nvalid == len(data)
+        if full.any():
+            coef[:, full] = np.linalg.solve(self.G, rhs[:, full])
+        gaps, = np.where(enough & ~full)
+        if len(gaps):
+            # normal matrix without the missing samples: G - A_missing^T A_missing
+            missing = (~valid[:, gaps]).astype(float)
+            G = self.G[None] - np.einsum('tp,tg,tq->gpq', self.A, missing, self.A)
+            try:
+                coef[:, gaps] = np.linalg.solve(G, rhs[:, gaps].T[..., None])[..., 0].T
+            except np.linalg.LinAlgError: # a singular channel, solve them one by one
+                for j, g in enumerate(gaps):
+                    try:
+                        coef[:, g] = np.linalg.solve(G[j], rhs[:, g])
+                    except np.linalg.LinAlgError:
+                        pass
+        return coef.reshape((coef.shape[0],) + shape)
+
+    def fit(self, data, t0=0.):
+        ''' mean, amplitude and phase (..., constituent) of a (time x channels) block and the fraction
+        of variance explained. t0: time origin of the time base, added to the phases
+        '''
+        data = np.asarray(data, dtype=float)
+        coef = self.coefficients(data)
+        fitted = np.tensordot(self.A, np.nan_to_num(coef), axes=(1, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            explained = 1 - np.nanvar(data - fitted, axis=0)/np.nanvar(data, axis=0)
+        return self._result(coef, t0, explained)
+
+    def _result(self, coef, t0, explained):
+        a, b = np.moveaxis(coef[1::2], 0, -1), np.moveaxis(coef[2::2], 0, -1)
+        t0 = np.asarray(t0, dtype=float)[..., None]
+        return {'names': self.names, 'freq': self.freqs, 'mean': coef[0],
+                'amplitude': np.hypot(a, b),
+                'phase': (np.degrees(np.arctan2(b, a)) + 360*self.freqs*t0) % 360,
+                'explained': explained}
+
+
+def fit_windows(time, data, dt, window=30., step=None, constituents=CONSTITUENTS, min_valid=0.5, batch=16):
+    ''' harmonic fit in sliding windows of a uniformly sampled (time x depth) record
+
+    the design matrix of one window is built once (relative times) and reused for every window
+    and depth, the phases are then shifted back to the absolute time origin.
+    data may be any array-like sliced along time (e.g. a MooringData LazyBlock), read batch windows at a time,
+    or a single series. Returns the keys of HarmonicFit.fit with a leading window axis, plus 'time' (window centers)
+    '''
+    single = np.ndim(data) == 1
+    if single:
+        data = np.asarray(data, dtype=float)[:, None]
+    step = window/2. if step is None else step
+    nperseg = int(round(window/dt))
+    nstep = max(int(round(step/dt)), 1)
+    nt = len(time)
+    nwin = 0 if nt < nperseg else (nt - nperseg)//nstep + 1
+    hf = HarmonicFit(np.arange(nperseg)*dt, constituents, min_valid)
+    out = []
+    for w0 in range(0, nwin, batch):
+        w1 = min(w0 + batch, nwin)
+        block = np.asarray(data[w0*nstep:(w1 - 1)*nstep + nperseg], dtype=float)
+        segments = sliding_windows(block, nperseg, nstep, axis=0)[:w1 - w0] # (window, time, depth)
+        coef = np.moveaxis(hf.coefficients(np.moveaxis(segments, 1, 0)), 1, 0) # (window, nparam, depth)
+        fitted = np.einsum('tp,wpc->wtc', hf.A, np.nan_to_num(coef))
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # windows of a padded level are all NaN
+            explained = 1 - np.nanvar(segments - fitted, axis=1)/np.nanvar(segments, axis=1)
+        t0 = np.asarray(time)[np.arange(w0, w1)*nstep]
+        res = hf._result(np.moveaxis(coef, 1, 0), t0.reshape((-1,) + (1,)*(coef.ndim - 2)), explained)
+        out.append(res)
+    keys = ['mean', 'amplitude', 'phase', 'explained']
+    res = {k: np.concatenate([o[k] for o in out]) if out else np.empty((0,)) for k in keys}
+    if single and out:
+        res = {k: v[:, 0] for k, v in res.items()}
+    res.update({'names': hf.names, 'freq': hf.freqs,
+                'time': np.asarray(time)[np.arange(nwin)*nstep + nperseg//2]})
+    return res
+
+
+def tidal_analysis(md, instrument, years, var='TEMP', window=30., step=None):
+    ''' {year: fit_windows result + 'depths'} of a mooring chain (MooringData md), one pass per year '''
+    from spectra_batch import sampling_interval
+    results = {}
+    for year in years:
+        if not md.exists(instrument, year):
+            continue
+        time = md.block_time(instrument, year) # sbe levels differ in length, lazy() pads them to the longest
+        if time is None:
+            continue
+        block = md.lazy(instrument, year, var, length=len(time))
+        results[year] = fit_windows(time, block, sampling_interval(instrument, year), window, step)
+        results[year]['depths'] = block.depths
+    return results